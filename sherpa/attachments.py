@@ -0,0 +1,96 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+
+from config import ATTACHMENT_CACHE_MAX_BYTES
+
+# Where the dashboard's Asset Manager stores uploads
+ASSETS_DIR = "assets"
+
+class AttachmentCache:
+    """
+    LRU cache of base64-encoded attachments keyed by content hash, so an asset
+    shared by many leads is read and encoded once. A (path, mtime, size) index
+    avoids re-reading unchanged files just to hash them.
+    """
+    def __init__(self, max_bytes=ATTACHMENT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # sha256 -> encoded payload
+        self.size = 0
+        self.file_hashes = {} # path -> (mtime_ns, size, sha256)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached_hash(self, path):
+        stat = os.stat(path)
+        known = self.file_hashes.get(path)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        return None
+
+    def encoded(self, path):
+        """
+        Returns the base64 payload for the file at path.
+        """
+        with self.lock:
+            digest = self._cached_hash(path)
+            if digest and digest in self.entries:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return self.entries[digest]
+
+        with open(path, "rb") as f:
+            data = f.read()
+        stat = os.stat(path)
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self.lock:
+            self.file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+            if digest in self.entries:
+                # Same content under another name (or a touched file)
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return self.entries[digest]
+            self.misses += 1
+            payload = base64.encodebytes(data).decode("ascii")
+            self._store(digest, payload)
+            return payload
+
+    def _store(self, digest, payload):
+        if len(payload) > self.max_bytes:
+            return # Too big to cache; encoded per use
+        while self.entries and self.size + len(payload) > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        self.entries[digest] = payload
+        self.size += len(payload)
+
+    def part(self, filename):
+        """
+        A ready-to-attach MIME part for an asset. Each call returns a fresh part
+        object sharing the cached payload string.
+        """
+        name = os.path.basename(filename)
+        path = os.path.join(ASSETS_DIR, name)
+        ctype, encoding = mimetypes.guess_type(path)
+        if ctype is None or encoding is not None:
+            ctype = "application/octet-stream"
+        maintype, subtype = ctype.split("/", 1)
+        part = MIMEBase(maintype, subtype)
+        part.set_payload(self.encoded(path))
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header("Content-Disposition", "attachment", filename=name)
+        return part
+
+_cache = AttachmentCache()
+
+def attachment_part(filename):
+    return _cache.part(filename)
+
+def attachment_exists(filename):
+    return os.path.isfile(os.path.join(ASSETS_DIR, os.path.basename(filename)))
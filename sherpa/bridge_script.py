@@ -1,151 +1,291 @@
 import requests
 import sqlite3
 import time
-import json
-from config import PHANTOMBUSTER_API_KEY, APOLLO_API_KEY, LINKEDIN_SEARCH_EXPORT_AGENT_ID, DB_PATH
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from config import PHANTOMBUSTER_API_KEY, APOLLO_API_KEY, LINKEDIN_SEARCH_EXPORT_AGENT_ID, DB_PATH, ENRICH_CONCURRENCY, APOLLO_TIMEOUT_SECONDS, APOLLO_BULK_SIZE
+from rate_limiter import limited_request
+from linkedin_urls import canonical_linkedin_url
+from enrichment_cache import get_cached, store, purge, cache_stats
+from ingest import ingest_leads
+from phantombuster import launch_agent, wait_for_container, stream_container_rows
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
+def make_apollo_session(concurrency=ENRICH_CONCURRENCY):
+    """
+    One pooled session for a run, so enrichment requests reuse keep-alive
+    connections instead of a new TLS handshake each.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Cache-Control": "no-cache"
+    })
+    return session
+
 def trigger_phantombuster(search_url):
     """
     Triggers the PhantomBuster LinkedIn Search Export phantom.
     Note: This is a simplified implementation. In a real scenario, you'd need to 
     handle the argument structure specific to the Phantom.
     """
-    url = "https://api.phantombuster.com/api/v2/agents/launch"
-    headers = {
-        "X-Phantombuster-Key": PHANTOMBUSTER_API_KEY,
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "id": LINKEDIN_SEARCH_EXPORT_AGENT_ID,
-        "argument": {
+    try:
+        container_id = launch_agent(LINKEDIN_SEARCH_EXPORT_AGENT_ID, {
             "searchUrl": search_url,
             "numberOfProfiles": 60 # As per requirements
-        }
-    }
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        print(f"PhantomBuster triggered: {response.json()}")
-        return response.json().get("containerId")
+        })
+        print(f"PhantomBuster triggered: container {container_id}")
+        return container_id
     except Exception as e:
         print(f"Error triggering PhantomBuster: {e}")
         return None
 
 def get_phantombuster_result(container_id):
     """
-    Polls for the result of the PhantomBuster run.
+    Waits for the container to finish, then yields its result rows while they
+    download. Errors end the stream early (the rows already yielded stand).
     """
-    url = f"https://api.phantombuster.com/api/v2/containers/{container_id}/output"
-    headers = {"X-Phantombuster-Key": PHANTOMBUSTER_API_KEY}
-    
-    print("Waiting for PhantomBuster to finish...")
-    # In reality, this might take minutes. We'll poll every 30 seconds.
-    # For this script, we'll just check once after a short sleep for demonstration,
-    # or assume we are fetching the latest result from a completed run.
-    
-    # improved logic: fetch latest result object
-    url_result = f"https://api.phantombuster.com/api/v2/agents/{LINKEDIN_SEARCH_EXPORT_AGENT_ID}/output"
+    print(f"Waiting for PhantomBuster container {container_id} to finish...")
     try:
-        response = requests.get(url_result, headers=headers)
-        response.raise_for_status()
-        output = response.json().get("output")
-        if output:
-            # PhantomBuster often returns JSON lines (one JSON object per line)
-            # or a list of objects.
-            try:
-                # Try parsing as a single JSON object/list
-                data = json.loads(output)
-                if isinstance(data, list):
-                    return data
-                elif isinstance(data, dict):
-                    return [data]
-            except json.JSONDecodeError:
-                # Try parsing as JSON lines
-                data = []
-                for line in output.splitlines():
-                    if line.strip():
-                        try:
-                            data.append(json.loads(line))
-                        except json.JSONDecodeError:
-                            pass
-                return data
+        container = wait_for_container(container_id)
+        if container.get("exitCode", 0) != 0:
+            print(f"PhantomBuster container {container_id} exited with code {container.get('exitCode')}; reading its partial results.")
+        yield from stream_container_rows(container_id)
     except Exception as e:
         print(f"Error getting PhantomBuster result: {e}")
-    return []
 
-def enrich_with_apollo(linkedin_url):
+def profile_urls(results):
+    for item in results:
+        # Adjust key based on actual PhantomBuster output
+        url = (item.get("profileUrl") or item.get("url") or item.get("linkedinUrl")) if isinstance(item, dict) else None
+        if url:
+            yield url
+
+def person_to_lead(person):
+    """
+    Lead fields from an Apollo person, or None if Apollo has no email for them.
+    """
+    if person and person.get("email"):
+        return {
+            "email": person.get("email"),
+            "first_name": person.get("first_name"),
+            "last_name": person.get("last_name"),
+            "title": person.get("title"),
+            "company": (person.get("organization") or {}).get("name"),
+            "location": (person.get("location") or {}).get("name") if isinstance(person.get("location"), dict) else None, # simplified
+            "verification_status": "verified" # Assuming Apollo returns verified emails mostly
+        }
+    return None
+
+def bulk_lookup_apollo(linkedin_urls, session=None):
     """
-    Queries Apollo API to find email for the given LinkedIn URL.
+    Matches up to APOLLO_BULK_SIZE LinkedIn URLs in one Apollo bulk_match call.
+    Returns the raw person (or None) for each URL, in order; errors are raised to the caller.
     """
-    url = "https://api.apollo.io/v1/people/match"
+    url = "https://api.apollo.io/v1/people/bulk_match"
     headers = {
         "Content-Type": "application/json",
         "Cache-Control": "no-cache"
     }
     payload = {
         "api_key": APOLLO_API_KEY,
-        "linkedin_url": linkedin_url
+        "details": [{"linkedin_url": linkedin_url} for linkedin_url in linkedin_urls]
     }
     
+    response = limited_request("apollo", "POST", url, session=session, headers=headers, json=payload,
+                               timeout=APOLLO_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    matches = response.json().get("matches") or []
+    # Apollo answers in request order; a profile it could not match is null
+    return [matches[i] if i < len(matches) else None for i in range(len(linkedin_urls))]
+
+def save_lead(lead_data, conn=None):
+    """
+    Inserts an enriched lead. Returns True if it was saved, False if it exists or failed.
+    Uses (and leaves open) conn if given.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        if response.status_code == 200:
-            data = response.json()
-            person = data.get("person")
-            if person and person.get("email"):
-                return {
-                    "email": person.get("email"),
-                    "first_name": person.get("first_name"),
-                    "last_name": person.get("last_name"),
-                    "title": person.get("title"),
-                    "company": person.get("organization", {}).get("name"),
-                    "location": person.get("location", {}).get("name"), # simplified
-                    "verification_status": "verified" # Assuming Apollo returns verified emails mostly
-                }
-    except Exception as e:
-        print(f"Error enriching {linkedin_url}: {e}")
-    
-    return None
+        result = ingest_leads(conn, [lead_data])
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return False
+    finally:
+        if own_conn:
+            conn.close()
+    if not result["inserted"]:
+        print(f"Lead {lead_data['linkedin_url']} already exists. Skipping.")
+        return False
+    print(f"Saved lead: {lead_data.get('email')}")
+    return True
+
+def mock_enrichment(index):
+    return {
+        "email": f"user{index}@example.com",
+        "first_name": "Mock",
+        "last_name": f"User{index}",
+        "company": "Mock Company",
+        "title": "CEO",
+        "location": "San Francisco",
+        "verification_status": "verified"
+    }
+
+def fetch_people(conn, urls_by_key, stats, concurrency=ENRICH_CONCURRENCY, session=None):
+    """
+    Yields (key, person or None) for every canonical key: cached answers first,
+    then bulk_match results as they complete (stored in the cache as they arrive).
+    Keys whose request failed are counted as errors and not yielded.
+    """
+    cached = get_cached(conn, urls_by_key)
+    stats["cached"] += len(cached)
+    for key, person in cached.items():
+        yield key, person
+
+    missing = [key for key in urls_by_key if key not in cached]
+    chunks = [missing[i:i + APOLLO_BULK_SIZE] for i in range(0, len(missing), APOLLO_BULK_SIZE)]
+    own_session = session is None
+    if own_session:
+        session = make_apollo_session(concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(bulk_lookup_apollo, [urls_by_key[key] for key in chunk], session): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                stats["api_calls"] += 1
+                try:
+                    people = future.result()
+                except Exception as e:
+                    stats["errors"] += len(chunk)
+                    print(f"Error enriching {len(chunk)} profiles: {e}")
+                    continue
+                results = dict(zip(chunk, people))
+                store(conn, results)
+                yield from results.items()
+    finally:
+        if own_session:
+            session.close()
+
+def load_known_keys(conn):
+    """
+    Canonical LinkedIn keys of every lead already in the database.
+    """
+    return {row[0] for row in conn.execute("SELECT linkedin_key FROM leads WHERE linkedin_key IS NOT NULL")}
 
-def save_lead(lead_data):
+def new_profiles(linkedin_urls, known_keys):
+    """
+    Returns {canonical key: first URL seen} for profiles not in known_keys:
+    one entry per profile however its URL is spelled; non-profile URLs are dropped.
+    """
+    urls_by_key = {}
+    for url in linkedin_urls:
+        key = canonical_linkedin_url(url)
+        if key and key not in known_keys:
+            urls_by_key.setdefault(key, url)
+    return urls_by_key
+
+def new_profile_batches(linkedin_urls, known_keys, stats, batch_size):
+    """
+    Yields {canonical key: URL} batches of up to batch_size new profiles as the
+    URLs arrive, counting every URL in stats["profiles"] and the known or
+    repeated ones in stats["known"].
+    """
+    batch = {}
+    for url in linkedin_urls:
+        stats["profiles"] += 1
+        key = canonical_linkedin_url(url)
+        if not key or key in known_keys:
+            stats["known"] += 1
+            continue
+        known_keys.add(key)
+        batch[key] = url
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+def enrich_profiles(linkedin_urls, mock_data=False, concurrency=ENRICH_CONCURRENCY):
+    """
+    Drops profiles that are already leads, enriches the rest (cache first, then
+    Apollo bulk_match on a bounded thread pool) and saves the hits in small
+    batches through ingest_leads; this thread is the only DB writer. URLs may
+    be a stream: enrichment starts with the first batch of new profiles.
+    Returns the run summary.
+    """
+    stats = {"profiles": 0, "known": 0, "hits": 0, "misses": 0, "errors": 0, "saved": 0, "existing": 0,
+             "cached": 0, "api_calls": 0}
+    started = time.time()
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if exists
-    cursor.execute("SELECT id FROM leads WHERE linkedin_url = ?", (lead_data['linkedin_url'],))
-    if cursor.fetchone():
-        print(f"Lead {lead_data['linkedin_url']} already exists. Skipping.")
+    session = None if mock_data else make_apollo_session(concurrency)
+    try:
+        # Known profiles are dropped before anything is paid for
+        batches = new_profile_batches(linkedin_urls, load_known_keys(conn), stats, APOLLO_BULK_SIZE * concurrency)
+        if mock_data:
+            counter = itertools.count()
+            results = ((url, mock_enrichment(next(counter))) for urls_by_key in batches for url in urls_by_key.values())
+        else:
+            results = ((urls_by_key[key], person_to_lead(person))
+                       for urls_by_key in batches
+                       for key, person in fetch_people(conn, urls_by_key, stats, concurrency, session))
+        def hits():
+            for url, enriched_data in results:
+                if not enriched_data:
+                    stats["misses"] += 1
+                    print(f"Could not enrich or verify email for {url}")
+                    continue
+                stats["hits"] += 1
+                enriched_data['linkedin_url'] = url
+                yield enriched_data
+        # Hits are written every APOLLO_BULK_SIZE leads, while later lookups are still running
+        saved = ingest_leads(conn, hits(), chunk_size=APOLLO_BULK_SIZE)
+        stats["saved"] = saved["inserted"]
+        stats["existing"] = stats["hits"] - saved["inserted"]
+    finally:
+        if session is not None:
+            session.close()
         conn.close()
-        return
+    stats["seconds"] = time.time() - started
+    return stats
 
-    sql = """
-    INSERT INTO leads (linkedin_url, first_name, last_name, email, company, title, location, verification_status, status)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Enriched')
+def warm_enrichment_cache(linkedin_urls, concurrency=ENRICH_CONCURRENCY):
+    """
+    Looks up profiles that have no fresh cache entry, without saving leads.
     """
+    stats = {"errors": 0, "cached": 0, "api_calls": 0}
+    conn = get_db_connection()
     try:
-        cursor.execute(sql, (
-            lead_data['linkedin_url'],
-            lead_data.get('first_name'),
-            lead_data.get('last_name'),
-            lead_data.get('email'),
-            lead_data.get('company'),
-            lead_data.get('title'),
-            lead_data.get('location'),
-            lead_data.get('verification_status')
-        ))
-        conn.commit()
-        print(f"Saved lead: {lead_data.get('email')}")
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
+        urls_by_key = new_profiles(linkedin_urls, set())
+        for _ in fetch_people(conn, urls_by_key, stats, concurrency):
+            pass
     finally:
         conn.close()
+    print(f"Cache warm: {stats['cached']} already cached, {len(urls_by_key) - stats['cached'] - stats['errors']} fetched "
+          f"in {stats['api_calls']} Apollo calls, {stats['errors']} errors")
+    return stats
 
-def run_bridge(search_url=None, mock_data=False):
+def print_bridge_summary(stats, conn=None):
+    """
+    Prints the run's stats and, with conn, the size of the enrichment cache.
+    """
+    print(f"Enriched {stats['profiles'] - stats['known']} of {stats['profiles']} profiles "
+          f"({stats['known']} known or duplicate skipped) in {stats['seconds']:.1f}s: "
+          f"{stats['hits']} hits ({stats['saved']} saved, {stats['existing']} already known), "
+          f"{stats['misses']} misses, {stats['errors']} errors; "
+          f"{stats['cached']} from cache, {stats['api_calls']} Apollo calls")
+    if conn is not None:
+        cached = cache_stats(conn)
+        print(f"Enrichment cache: {cached['hits']} profiles with an email, {cached['misses']} without")
+
+def run_bridge(search_url=None, mock_data=False, container_id=None):
     if mock_data:
         print("Running in MOCK mode.")
         # Mock PhantomBuster results
@@ -153,52 +293,28 @@ def run_bridge(search_url=None, mock_data=False):
             "https://www.linkedin.com/in/mock-user-1/",
             "https://www.linkedin.com/in/mock-user-2/"
         ]
+    elif container_id:
+        # Re-read the results of an earlier run
+        linkedin_urls = profile_urls(get_phantombuster_result(container_id))
     else:
         if not search_url:
             print("No search URL provided.")
             return
         
-        # 1. Trigger PhantomBuster (Skipping actual trigger for safety in dev, assuming we fetch latest)
-        # container_id = trigger_phantombuster(search_url)
-        # results = get_phantombuster_result(container_id)
-        
-        # For production, we fetch the latest results from the agent
-        print("Fetching results from PhantomBuster...")
-        results = get_phantombuster_result(None)
-        
-        linkedin_urls = []
-        for item in results:
-            # Adjust key based on actual PhantomBuster output
-            url = item.get("profileUrl") or item.get("url") or item.get("linkedinUrl")
-            if url:
-                linkedin_urls.append(url)
-
-    print(f"Found {len(linkedin_urls)} profiles to enrich.")
+        # 1. Trigger PhantomBuster and wait for this run's container
+        container_id = trigger_phantombuster(search_url)
+        if not container_id:
+            return
+        # 2. Profiles are enriched in batches while the export is still downloading
+        linkedin_urls = profile_urls(get_phantombuster_result(container_id))
 
-    for url in linkedin_urls:
-        print(f"Processing: {url}")
-        
-        if mock_data:
-            # Mock Apollo Enrichment
-            enriched_data = {
-                "linkedin_url": url,
-                "email": f"user{linkedin_urls.index(url)}@example.com",
-                "first_name": "Mock",
-                "last_name": f"User{linkedin_urls.index(url)}",
-                "company": "Mock Company",
-                "title": "CEO",
-                "location": "San Francisco",
-                "verification_status": "verified"
-            }
-        else:
-            enriched_data = enrich_with_apollo(url)
-            if enriched_data:
-                enriched_data['linkedin_url'] = url
-        
-        if enriched_data:
-            save_lead(enriched_data)
-        else:
-            print(f"Could not enrich or verify email for {url}")
+    stats = enrich_profiles(linkedin_urls, mock_data)
+    conn = get_db_connection()
+    try:
+        print_bridge_summary(stats, conn)
+    finally:
+        conn.close()
+    return stats
 
 if __name__ == "__main__":
     # Example usage
@@ -208,6 +324,20 @@ if __name__ == "__main__":
     
     if len(sys.argv) > 1 and sys.argv[1] == "--mock":
         run_bridge(mock_data=True)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--purge-cache":
+        # --purge-cache [misses|expired]
+        mode = sys.argv[2] if len(sys.argv) > 2 else None
+        conn = get_db_connection()
+        deleted = purge(conn, misses_only=mode == "misses", expired_only=mode == "expired")
+        conn.close()
+        print(f"Deleted {deleted} enrichment cache entries.")
+    elif len(sys.argv) > 2 and sys.argv[1] == "--container":
+        # --container <id>: enrich the results of an earlier search export run
+        run_bridge(container_id=sys.argv[2])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--warm-cache":
+        # --warm-cache urls.txt (one LinkedIn URL per line)
+        with open(sys.argv[2]) as f:
+            warm_enrichment_cache([line.strip() for line in f if line.strip()])
     else:
         # Use URL from config if available
         if LINKEDIN_SEARCH_URL:
@@ -7,10 +7,82 @@ APOLLO_API_KEY = None
 GEMINI_API_KEY = None
 PHANTOMBUSTER_AGENT_ID = None
 LINKEDIN_CONNECTION_AGENT_ID = None
+LINKEDIN_SEARCH_EXPORT_AGENT_ID = None
 DB_PATH = "leads.db"
 DAILY_LEAD_LIMIT = 50
 LINKEDIN_SEARCH_URL = "https://www.linkedin.com/search/results/people/?keywords=founder&origin=SWITCH_SEARCH_VERTICAL"
 
+# Workers
+LEASE_SECONDS = 600 # How long a claimed lead stays reserved for one worker
+SENDER_CLAIM_BATCH = 10 # Outbox messages a sender claims per channel at a time
+
+# Sender: pause (min, max seconds) between two sends on the same channel
+SEND_PACING_SECONDS = {
+    "email": (10, 30),
+    "linkedin": (2, 5),
+    "whatsapp": (5, 10),
+}
+SENDER_PROGRESS_SECONDS = 30 # How often per-channel progress is printed
+ATTACHMENT_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Encoded attachments kept in memory by the sender
+WHATSAPP_LOAD_TIMEOUT = 60 # Seconds to wait for a WhatsApp chat to open
+WHATSAPP_SENT_TIMEOUT = 30 # Seconds to wait for the sent tick after pressing Enter
+CHROMEDRIVER_PATH = None # Fixed chromedriver binary; None resolves it with webdriver_manager once
+
+# Send scheduler: each channel (each Gmail account, for email) sends at most
+# DAILY_LEAD_LIMIT messages per local day, spread evenly over the send window
+GMAIL_DAILY_SEND_CAP = 450 # Gmail allows 500 sends/day on a consumer account (2,000 on Workspace)
+SEND_WINDOW_HOURS = (9, 18) # Local hours [start, end) during which scheduled sends go out
+
+# Gmail sending accounts: name -> OAuth token file. Every lead is pinned to one
+# account, and each account gets its own daily quota (so email throughput scales
+# with the number of accounts); the listener polls every inbox.
+GMAIL_ACCOUNTS = {
+    "default": "token.json",
+}
+GMAIL_ACCOUNT_MAX_FAILURES = 3 # Failed sends in a row before an account cools down
+GMAIL_ACCOUNT_COOLDOWN_SECONDS = 3600
+
+# Outbox retries: BASE * 2^(attempt-1) seconds, capped at MAX
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 60
+OUTBOX_RETRY_MAX_SECONDS = 3600
+
+# Rate limits per provider (or "provider:model"): rate = requests/second, burst = bucket size
+RATE_LIMITS = {
+    "default": {"rate": 1.0, "burst": 5},
+    "gemini": {"rate": 0.25, "burst": 4},
+    "gemini:gemini-2.0-flash": {"rate": 0.25, "burst": 4},
+    "apollo": {"rate": 0.5, "burst": 5},
+    "phantombuster": {"rate": 0.1, "burst": 2},
+    "gmail": {"rate": 5.0, "burst": 10},
+}
+RATE_LIMIT_MAX_RETRIES = 4 # Retries after a 429 before giving up on a call
+
+# Drafter
+DRAFTER_CONCURRENCY = 4 # Parallel Gemini requests
+DRAFTER_BATCH_SIZE = 5 # Leads per Gemini request (1 disables batching)
+DRAFTER_WRITE_BATCH = 25 # Drafts per write transaction
+FEW_SHOT_EXAMPLES = 2 # Closest training examples per prompt
+EXAMPLE_CONTEXT_BOOST = 2.0 # Weight of an example's context notes vs. its content
+
+# Bridge (PhantomBuster -> Apollo)
+PHANTOMBUSTER_POLL_SECONDS = (5, 60) # Container polling backs off from the first to the second value
+PHANTOMBUSTER_RUN_TIMEOUT_SECONDS = 1800 # Give up waiting for a search export after this long
+ENRICH_CONCURRENCY = 8 # Parallel Apollo lookups (the apollo rate limit still applies)
+APOLLO_TIMEOUT_SECONDS = 20 # Per-request timeout for Apollo calls
+APOLLO_BULK_SIZE = 10 # Profiles per Apollo bulk_match request (Apollo's maximum)
+ENRICHMENT_CACHE_TTL_DAYS = 90 # How long an Apollo match is reused
+ENRICHMENT_NEGATIVE_TTL_DAYS = 14 # How long a profile without an email is not looked up again
+
+# Lead ingestion (bridge, uploads, manual and AI-discovered leads)
+INGEST_CHUNK_SIZE = 5000 # Leads written per transaction
+
+# Listener
+LISTENER_FULL_SCAN_LIMIT = 500 # Max unread messages scanned when Gmail history has expired
+GMAIL_BATCH_SIZE = 50 # Requests per Gmail batch HTTP call (Gmail recommends <= 50)
+REPLY_BODY_MAX_CHARS = 4000 # Reply text passed to the classifier
+LISTENER_KNOWN_THREADS_ONLY = False # Only look at replies in threads we started (skips From matching)
+
 # 1. Try loading from local config (for local development)
 try:
     from .config_local import *
@@ -32,3 +104,4 @@ APOLLO_API_KEY = load_secret("APOLLO_API_KEY", APOLLO_API_KEY)
 GEMINI_API_KEY = load_secret("GEMINI_API_KEY", GEMINI_API_KEY)
 PHANTOMBUSTER_AGENT_ID = load_secret("PHANTOMBUSTER_AGENT_ID", PHANTOMBUSTER_AGENT_ID)
 LINKEDIN_CONNECTION_AGENT_ID = load_secret("LINKEDIN_CONNECTION_AGENT_ID", LINKEDIN_CONNECTION_AGENT_ID)
+LINKEDIN_SEARCH_EXPORT_AGENT_ID = load_secret("LINKEDIN_SEARCH_EXPORT_AGENT_ID", LINKEDIN_SEARCH_EXPORT_AGENT_ID)
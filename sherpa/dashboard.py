@@ -5,6 +5,8 @@ from config import DB_PATH
 import time
 import os
 from db_setup import setup_database
+from ingest import ingest_leads, LeadIndex
+from lead_upload import preview_lead_file, read_lead_file, resolve_columns, map_leads, reject_rows
 
 # Ensure DB exists on startup (for Cloud Deployment)
 if not os.path.exists(DB_PATH):
@@ -65,20 +67,26 @@ def update_draft(lead_id, subject, body, li_note, wa_nudge):
 
 def add_manual_lead(first_name, last_name, email, phone, linkedin_url, company, title, location):
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("""
-            INSERT INTO leads (first_name, last_name, email, phone, linkedin_url, company, title, location, status, verification_status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Enriched', 'Manual')
-        """, (first_name, last_name, email, phone, linkedin_url, company, title, location))
-        conn.commit()
-        st.success(f"Lead {first_name} {last_name} added successfully! Run 'drafter.py' to generate content.")
-    except sqlite3.IntegrityError:
-        st.error("Error: A lead with this LinkedIn URL already exists.")
+        result = ingest_leads(conn, [{
+            "first_name": first_name, "last_name": last_name, "email": email, "phone": phone,
+            "linkedin_url": linkedin_url, "company": company, "title": title, "location": location,
+        }], verification_status='Manual')
+        if result["inserted"]:
+            st.success(f"Lead {first_name} {last_name} added successfully! Run 'drafter.py' to generate content.")
+        elif result["updated"]:
+            st.info("This lead already exists; its missing details were filled in.")
+        else:
+            st.error("Error: A lead with this LinkedIn URL, email or phone already exists.")
     except Exception as e:
         st.error(f"Database error: {e}")
-from sender import run_sender
+    finally:
+        conn.close()
+from sender import run_sender, start_dispatcher, active_channels
+from scheduler import quota_status
+from gmail_accounts import account_status
 from drafter import run_drafter
+import example_index
 
 # Sidebar Navigation
 st.sidebar.title("🏔️ SHERPA")
@@ -97,10 +105,11 @@ if st.sidebar.button("✨ Generate Drafts"):
             st.sidebar.error(f"Error generating drafts: {e}")
 
 if st.sidebar.button("🚀 Send Approved Messages"):
-    with st.spinner("Sending messages... Check the terminal for WhatsApp QR code if needed."):
+    with st.spinner("Scheduling messages..."):
         try:
             run_sender()
-            st.sidebar.success("Outreach cycle completed!")
+            start_dispatcher()
+            st.sidebar.success("Messages scheduled! They go out as their slots come due (check the terminal for the WhatsApp QR code if needed).")
         except Exception as e:
             st.sidebar.error(f"Error during outreach: {e}")
 
@@ -135,8 +144,33 @@ elif page == "Lead Tracker":
     conn = get_db_connection()
     # Fetch all leads
     df = pd.read_sql_query("SELECT * FROM leads ORDER BY updated_at DESC", conn)
+    # Outbound messages per channel and state
+    outbox_df = pd.read_sql_query("SELECT channel, state, COUNT(*) AS messages FROM outbox GROUP BY channel, state", conn)
+    quotas = quota_status(conn, active_channels())
+    accounts = account_status(conn)
     conn.close()
     
+    if not outbox_df.empty:
+        st.markdown("### Outbox")
+        st.dataframe(outbox_df.pivot(index='channel', columns='state', values='messages').fillna(0).astype(int), use_container_width=True)
+        
+        st.markdown("### Send Schedule")
+        schedule_df = pd.DataFrame([
+            {
+                "channel": channel,
+                "daily limit": quota['limit'],
+                "scheduled today": quota['used'],
+                "sent today": quota['sent'],
+                "remaining today": quota['remaining'],
+                "next send": quota['next_send'].astimezone().strftime("%Y-%m-%d %H:%M") if quota['next_send'] else "—",
+            }
+            for channel, quota in quotas.items()
+        ])
+        st.dataframe(schedule_df.set_index("channel"), use_container_width=True)
+        
+        st.markdown("### Gmail Accounts")
+        st.dataframe(pd.DataFrame(accounts).set_index("name"), use_container_width=True)
+    
     # Filters
     status_filter = st.multiselect("Filter by Status", options=df['status'].unique(), default=df['status'].unique())
     
@@ -165,73 +199,41 @@ elif page == "Upload Leads":
     
     if uploaded_file is not None:
         try:
-            if uploaded_file.name.endswith('.csv'):
-                df = pd.read_csv(uploaded_file)
-            else:
-                df = pd.read_excel(uploaded_file)
-            
             st.write("Preview:")
-            st.dataframe(df.head())
+            st.dataframe(preview_lead_file(uploaded_file))
             
             if st.button("Import Leads"):
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                success_count = 0
-                error_count = 0
-                
                 progress_bar = st.progress(0)
+                totals = {"inserted": 0, "updated": 0, "skipped": 0}
+                rejected = []
                 
-                for index, row in df.iterrows():
-                    # Smart Column Mapping
-                    # Normalize column names to lowercase for matching
-                    row_keys = {k.lower(): k for k in df.columns}
-                    
-                    def get_val(key_list):
-                        for k in key_list:
-                            if k in row_keys:
-                                return row[row_keys[k]]
-                        return ""
-
-                    # Extract fields
-                    first_name = ""
-                    last_name = ""
-                    
-                    full_name = get_val(['name', 'full name', 'fullname'])
-                    if full_name:
-                        parts = str(full_name).split(' ', 1)
-                        first_name = parts[0]
-                        last_name = parts[1] if len(parts) > 1 else ""
-                    else:
-                        first_name = get_val(['first name', 'firstname', 'first_name'])
-                        last_name = get_val(['last name', 'lastname', 'last_name'])
-                        
-                    email = get_val(['email', 'email address'])
-                    linkedin = get_val(['linkedin', 'linkedin url', 'linkedin_url', 'profile'])
-                    company = get_val(['company', 'company name'])
-                    title = get_val(['title', 'job title', 'role'])
-                    location = get_val(['location', 'city', 'country'])
-                    phone = get_val(['phone', 'phone number', 'mobile'])
-
-                    if first_name and (email or phone or linkedin):
-                        try:
-                            cursor.execute("""
-                                INSERT INTO leads (first_name, last_name, email, phone, linkedin_url, company, title, location, status, verification_status)
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Enriched', 'Manual')
-                            """, (first_name, last_name, email, phone, linkedin, company, title, location))
-                            success_count += 1
-                        except sqlite3.IntegrityError:
-                            error_count += 1 # Duplicate
-                        except Exception as e:
-                            st.error(f"Error importing row {index}: {e}")
-                    else:
-                        # Optional: Log skipped rows
-                        pass
-                    
-                    progress_bar.progress((index + 1) / len(df))
-                
-                conn.commit()
-                conn.close()
-                st.success(f"Imported {success_count} leads successfully! ({error_count} duplicates skipped)")
+                conn = get_db_connection()
+                try:
+                    index = LeadIndex(conn)
+                    columns = None
+                    for chunk, done in read_lead_file(uploaded_file):
+                        # Smart Column Mapping, resolved once per file
+                        if columns is None:
+                            columns = resolve_columns(chunk.columns)
+                        result = ingest_leads(conn, map_leads(chunk, columns), verification_status='Manual',
+                                              require_name=True, index=index)
+                        for key in totals:
+                            totals[key] += result[key]
+                        rows = reject_rows(chunk, result['rejects'])
+                        if rows is not None:
+                            rejected.append(rows)
+                        progress_bar.progress(done)
+                finally:
+                    conn.close()
+                progress_bar.progress(1.0)
+                st.session_state['upload_rejects'] = pd.concat(rejected) if rejected else None
+                st.success(f"Imported {totals['inserted']} leads successfully! "
+                           f"({totals['updated']} existing leads updated, {totals['skipped']} rows skipped)")
+            
+            rejects = st.session_state.get('upload_rejects')
+            if rejects is not None:
+                st.download_button(f"⬇️ Download reject report ({len(rejects)} rows)", rejects.to_csv(index=False),
+                                   file_name="rejected_leads.csv", mime="text/csv")
                 
         except Exception as e:
             st.error(f"Error processing file: {e}")
@@ -251,6 +253,7 @@ elif page == "AI Discovery":
                     import google.generativeai as genai
                     import json
                     from config import GEMINI_API_KEY
+                    from rate_limiter import call_with_limit
                     
                     genai.configure(api_key=GEMINI_API_KEY)
                     model = genai.GenerativeModel('gemini-flash-latest')
@@ -287,7 +290,7 @@ elif page == "AI Discovery":
                     ]
                     """
                     
-                    response = model.generate_content(ai_query)
+                    response = call_with_limit("gemini", "gemini-flash-latest", model.generate_content, ai_query)
                     content = response.text.replace('```json', '').replace('```', '').strip()
                     leads_data = json.loads(content)
                     
@@ -306,34 +309,14 @@ elif page == "AI Discovery":
         
         if st.button("📥 Add All to Database"):
             conn = get_db_connection()
-            cursor = conn.cursor()
-            added = 0
-            skipped = 0
-            
-            for lead in st.session_state['ai_leads']:
-                try:
-                    cursor.execute("""
-                        INSERT INTO leads (first_name, last_name, email, phone, linkedin_url, company, title, location, status, verification_status)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Enriched', 'AI_Generated')
-                    """, (
-                        lead.get('first_name', 'Founder'), 
-                        lead.get('last_name', ''), 
-                        lead.get('email', ''), 
-                        lead.get('phone', ''), 
-                        lead.get('linkedin_url', ''), 
-                        lead.get('company', ''), 
-                        lead.get('title', 'Founder'), 
-                        lead.get('location', '')
-                    ))
-                    added += 1
-                except sqlite3.IntegrityError:
-                    skipped += 1
-                except Exception as e:
-                    st.error(f"Error adding {lead.get('company')}: {e}")
-            
-            conn.commit()
-            conn.close()
-            st.success(f"Added {added} leads to database! ({skipped} duplicates skipped)")
+            try:
+                result = ingest_leads(conn, (
+                    {**lead, "first_name": lead.get('first_name') or 'Founder', "title": lead.get('title') or 'Founder'}
+                    for lead in st.session_state['ai_leads']
+                ), verification_status='AI_Generated')
+            finally:
+                conn.close()
+            st.success(f"Added {result['inserted']} leads to database! ({result['skipped']} duplicates skipped)")
             del st.session_state['ai_leads'] # Clear after adding
 
 elif page == "Train Sherpa":
@@ -353,6 +336,7 @@ elif page == "Train Sherpa":
             cursor.execute("INSERT INTO examples (type, content, context) VALUES (?, ?, ?)", (ex_type, ex_content, ex_context))
             conn.commit()
             conn.close()
+            example_index.invalidate(ex_type)
             st.success("Example saved! Sherpa will use this to learn your style.")
             
     st.markdown("---")
@@ -371,6 +355,7 @@ elif page == "Train Sherpa":
                     conn.execute("DELETE FROM examples WHERE id = ?", (row['id'],))
                     conn.commit()
                     conn.close()
+                    example_index.invalidate(row['type'])
                     st.rerun()
     else:
         st.info("No examples added yet. Add some above!")
@@ -3,6 +3,7 @@ import os
 from datetime import datetime
 
 from config import DB_PATH
+from linkedin_urls import canonical_linkedin_url
 
 def create_connection():
     """Create a database connection to the SQLite database."""
@@ -20,7 +21,7 @@ def create_table(conn):
     create_leads_table_sql = """
     CREATE TABLE IF NOT EXISTS leads (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        linkedin_url TEXT NOT NULL UNIQUE,
+        linkedin_url TEXT UNIQUE, -- NULL for leads found by email/phone only
         first_name TEXT,
         last_name TEXT,
         email TEXT,
@@ -47,12 +48,96 @@ def create_table(conn):
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     """
+    create_rate_limits_table_sql = """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY, -- provider or provider:model
+        tokens REAL,
+        updated_at REAL,
+        blocked_until REAL, -- unix time; set from 429 / Retry-After
+        penalty INTEGER DEFAULT 0, -- refill rate is halved per level
+        last_limited_at REAL
+    );
+    """
+    create_sync_state_table_sql = """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY, -- e.g. 'gmail_history_id'
+        value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    create_classification_cache_table_sql = """
+    CREATE TABLE IF NOT EXISTS classification_cache (
+        body_hash TEXT PRIMARY KEY, -- sha256 of the normalized reply, quoted history stripped
+        category TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    create_sent_messages_table_sql = """
+    CREATE TABLE IF NOT EXISTS sent_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lead_id INTEGER,
+        gmail_message_id TEXT UNIQUE,
+        thread_id TEXT,
+        to_email TEXT,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    create_outbox_table_sql = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lead_id INTEGER,
+        channel TEXT, -- 'email', 'linkedin', 'whatsapp'
+        state TEXT DEFAULT 'pending', -- 'pending', 'sending', 'launched', 'sent', 'dead', 'cancelled'
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        idempotency_key TEXT UNIQUE, -- '<lead_id>:<channel>'
+        external_id TEXT, -- Gmail message id / PhantomBuster container id
+        claimed_by TEXT,
+        lease_expires_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    );
+    """
+    create_gmail_accounts_table_sql = """
+    CREATE TABLE IF NOT EXISTS gmail_accounts (
+        name TEXT PRIMARY KEY, -- key in config.GMAIL_ACCOUNTS
+        consecutive_failures INTEGER DEFAULT 0,
+        disabled_until TIMESTAMP, -- cooling down after repeated failures
+        last_error TEXT,
+        last_sent_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
+    create_enrichment_cache_table_sql = """
+    CREATE TABLE IF NOT EXISTS enrichment_cache (
+        linkedin_key TEXT PRIMARY KEY, -- canonical LinkedIn URL
+        response TEXT, -- raw Apollo person JSON; NULL for a miss
+        found INTEGER, -- 1 = match with email data, 0 = miss (negative entry)
+        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """
     try:
         c = conn.cursor()
         c.execute(create_leads_table_sql)
         print("Table 'leads' created successfully.")
         c.execute(create_examples_table_sql)
         print("Table 'examples' created successfully.")
+        c.execute(create_rate_limits_table_sql)
+        print("Table 'rate_limits' created successfully.")
+        c.execute(create_sync_state_table_sql)
+        print("Table 'sync_state' created successfully.")
+        c.execute(create_classification_cache_table_sql)
+        print("Table 'classification_cache' created successfully.")
+        c.execute(create_sent_messages_table_sql)
+        print("Table 'sent_messages' created successfully.")
+        c.execute(create_outbox_table_sql)
+        print("Table 'outbox' created successfully.")
+        c.execute(create_gmail_accounts_table_sql)
+        print("Table 'gmail_accounts' created successfully.")
+        c.execute(create_enrichment_cache_table_sql)
+        print("Table 'enrichment_cache' created successfully.")
     except sqlite3.Error as e:
         print(e)
 
@@ -64,6 +149,78 @@ def add_column_if_not_exists(conn, table, column, col_type):
     except sqlite3.OperationalError:
         pass # Column likely exists
 
+def allow_leads_without_linkedin(conn):
+    """
+    Older databases declare leads.linkedin_url NOT NULL, so only one lead without
+    a LinkedIn URL could ever be stored. SQLite cannot drop a constraint, so the
+    table is rebuilt from its own schema with the NOT NULL removed.
+    """
+    try:
+        c = conn.cursor()
+        columns = c.execute("PRAGMA table_info(leads)").fetchall()
+        if not any(column[1] == "linkedin_url" and column[3] for column in columns):
+            return
+        create_sql = c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'leads'").fetchone()[0]
+        create_sql = create_sql.replace("linkedin_url TEXT NOT NULL UNIQUE", "linkedin_url TEXT UNIQUE", 1)
+        create_sql = create_sql.replace("CREATE TABLE leads", "CREATE TABLE leads_rebuild", 1)
+        column_list = ", ".join(column[1] for column in columns)
+        conn.commit()
+        c.execute("BEGIN")
+        c.execute(create_sql)
+        c.execute(f"INSERT INTO leads_rebuild ({column_list}) SELECT {column_list} FROM leads")
+        c.execute("DROP TABLE leads")
+        c.execute("ALTER TABLE leads_rebuild RENAME TO leads")
+        # Placeholders stored by older imports become real blanks
+        c.execute("UPDATE leads SET linkedin_url = NULL WHERE TRIM(linkedin_url) IN ('', 'N/A', 'n/a')")
+        conn.commit()
+        print("Table 'leads' now accepts leads without a LinkedIn URL.")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(e)
+
+def migrate_linkedin_keys(conn):
+    """
+    Fills leads.linkedin_key (canonical profile URL) for rows that do not have one.
+    When several existing rows are the same profile, the oldest keeps the key and
+    the others are left without one (reported, not deleted).
+    """
+    try:
+        c = conn.cursor()
+        taken = {row[0] for row in c.execute("SELECT linkedin_key FROM leads WHERE linkedin_key IS NOT NULL")}
+        updates = []
+        duplicates = 0
+        for lead_id, linkedin_url in c.execute("SELECT id, linkedin_url FROM leads WHERE linkedin_key IS NULL ORDER BY id").fetchall():
+            key = canonical_linkedin_url(linkedin_url)
+            if not key:
+                continue
+            if key in taken:
+                duplicates += 1
+                continue
+            taken.add(key)
+            updates.append((key, lead_id))
+        c.executemany("UPDATE leads SET linkedin_key = ? WHERE id = ?", updates)
+        conn.commit()
+        if updates:
+            print(f"Stored canonical LinkedIn keys for {len(updates)} leads.")
+        if duplicates:
+            print(f"{duplicates} leads duplicate another lead's LinkedIn profile and were left without a key.")
+    except sqlite3.Error as e:
+        print(e)
+
+def create_indexes(conn):
+    try:
+        c = conn.cursor()
+        c.execute("CREATE INDEX IF NOT EXISTS idx_leads_status ON leads (status, lease_expires_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_leads_claimed_by ON leads (claimed_by)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_thread ON sent_messages (thread_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_lead ON sent_messages (lead_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (channel, state, next_attempt_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_scheduled ON outbox (channel, scheduled_at)")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_leads_linkedin_key ON leads (linkedin_key)")
+        conn.commit()
+    except sqlite3.Error as e:
+        print(e)
+
 def setup_database():
     if os.path.exists(DB_PATH):
         print(f"Database {DB_PATH} already exists.")
@@ -73,6 +230,20 @@ def setup_database():
         create_table(conn)
         # Migration: Add attachment_file column if it doesn't exist
         add_column_if_not_exists(conn, "leads", "attachment_file", "TEXT")
+        # Migration: Work leases so several drafter/sender workers can share the DB
+        add_column_if_not_exists(conn, "leads", "claimed_by", "TEXT")
+        add_column_if_not_exists(conn, "leads", "lease_expires_at", "TIMESTAMP")
+        # Migration: Planned send slot per outbox row (see scheduler.py)
+        add_column_if_not_exists(conn, "outbox", "scheduled_at", "TIMESTAMP")
+        # Migration: Gmail account pool (lead -> sending account; account per email row)
+        add_column_if_not_exists(conn, "leads", "sender_account", "TEXT")
+        add_column_if_not_exists(conn, "outbox", "account", "TEXT")
+        add_column_if_not_exists(conn, "sent_messages", "account", "TEXT")
+        # Migration: Canonical LinkedIn profile key for dedupe (see linkedin_urls.py)
+        add_column_if_not_exists(conn, "leads", "linkedin_key", "TEXT")
+        allow_leads_without_linkedin(conn)
+        migrate_linkedin_keys(conn)
+        create_indexes(conn)
         conn.close()
     else:
         print("Error! cannot create the database connection.")
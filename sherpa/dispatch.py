@@ -0,0 +1,137 @@
+import queue
+import random
+import threading
+import time
+
+class ChannelUnavailable(Exception):
+    """
+    Reported for every job of a worker whose session could not be opened.
+    """
+
+class ChannelWorker(threading.Thread):
+    """
+    Sends one channel's messages from its own queue with its own pacing,
+    so a slow or stalled channel never holds up the others.
+
+    open_session() runs lazily on the worker thread when the first job arrives
+    and returns the object passed to send(session, job); close_session(session)
+    runs when the worker stops. send() returns a truthy value on success and
+    returns falsy or raises on failure. If a results queue is given, every job
+    is reported there as (channel, job, ok, value_or_error); a raised error is
+    reported as the exception object, so callers can tell failures apart.
+    """
+    def __init__(self, channel, send, pacing=None, open_session=None, close_session=None, results=None):
+        super().__init__(name=f"sender-{channel}", daemon=True)
+        self.channel = channel
+        self.send = send
+        self.pacing = pacing
+        self.open_session = open_session
+        self.close_session = close_session
+        self.results = results
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.stats = {"queued": 0, "sent": 0, "failed": 0}
+        self.latencies = [] # Seconds per successful send, pacing excluded
+        self.started_at = None
+        self.next_send_at = 0
+
+    def submit(self, job):
+        with self.lock:
+            self.stats["queued"] += 1
+        self.jobs.put(job)
+
+    def close(self):
+        """
+        Stops the worker once its queue is drained.
+        """
+        self.jobs.put(None)
+
+    def drain(self):
+        """
+        Takes the jobs that have not started yet off the queue and returns them.
+        """
+        jobs = []
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                jobs.append(job)
+        with self.lock:
+            self.stats["queued"] -= len(jobs)
+        return jobs
+
+    def backlog(self):
+        return self.jobs.qsize()
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def run(self):
+        self.started_at = time.time()
+        session = None
+        opened = False
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                if not opened:
+                    opened = True
+                    if self.open_session:
+                        session = self._open()
+                if self.open_session and session is None:
+                    self._report(job, False, ChannelUnavailable(f"{self.channel} channel could not start"))
+                    continue
+                self._wait_for_pacing()
+                started = time.time()
+                try:
+                    value = self.send(session, job)
+                    ok = bool(value)
+                    if not ok:
+                        value = f"{self.channel} send failed"
+                except Exception as e:
+                    print(f"[{self.channel}] Error: {e}")
+                    ok, value = False, e
+                if ok:
+                    with self.lock:
+                        self.latencies.append(time.time() - started)
+                self._report(job, ok, value)
+                if ok and self.pacing:
+                    self.next_send_at = time.time() + random.uniform(*self.pacing)
+        finally:
+            if session is not None and self.close_session:
+                self.close_session(session)
+
+    def _report(self, job, ok, value):
+        self._count("sent" if ok else "failed")
+        if self.results is not None:
+            self.results.put((self.channel, job, ok, value))
+
+    def _wait_for_pacing(self):
+        wait = self.next_send_at - time.time()
+        if wait > 0:
+            print(f"[{self.channel}] Throttling: Sleeping for {wait:.0f} seconds...")
+            time.sleep(wait)
+
+    def _open(self):
+        try:
+            return self.open_session()
+        except Exception as e:
+            print(f"[{self.channel}] Could not start: {e}")
+            return None
+
+    def progress(self):
+        with self.lock:
+            stats = dict(self.stats)
+            latencies = sorted(self.latencies)
+        done = stats["sent"] + stats["failed"]
+        elapsed = time.time() - self.started_at if self.started_at else 0
+        rate = f", {stats['sent'] / elapsed * 60:.1f}/min" if elapsed and stats["sent"] else ""
+        if latencies:
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[int(0.95 * (len(latencies) - 1))]
+            rate += f", {p50:.1f}s p50 / {p95:.1f}s p95 per message"
+        return f"{self.channel}: {done}/{stats['queued']} done ({stats['sent']} sent, {stats['failed']} failed{rate})"
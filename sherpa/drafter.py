@@ -1,41 +1,47 @@
 import google.generativeai as genai
 import sqlite3
 import json
-from config import GEMINI_API_KEY, DB_PATH
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import GEMINI_API_KEY, DB_PATH, DRAFTER_CONCURRENCY, DRAFTER_WRITE_BATCH, DRAFTER_BATCH_SIZE, FEW_SHOT_EXAMPLES
+from example_index import get_example_index, lead_query_text
+from leases import make_worker_id, claim_leads, release_leads
+from rate_limiter import call_with_limit
 
 # Configure Gemini
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Leads waiting for a draft
+DRAFTABLE = "status IN ('Enriched', 'New') AND draft_email_body IS NULL"
+
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
-def generate_drafts(lead, cursor):
+DRAFT_MODEL = 'gemini-flash-latest'
+_model = None
+
+def get_model():
     """
-    Generates email, LinkedIn note, and WhatsApp nudge using Gemini.
+    Returns the shared Gemini model, creating it on first use.
     """
-    model = genai.GenerativeModel('gemini-flash-latest')
-    
-    # Construct the prompt (The "Noboru Protocol")
-    # Fetch Examples for Few-Shot Learning
-    cursor.execute("SELECT content FROM examples WHERE type = 'Email' ORDER BY RANDOM() LIMIT 2")
-    email_examples = cursor.fetchall()
-    email_examples_text = "\n\n".join([f"Example {i+1}:\n{ex[0]}" for i, ex in enumerate(email_examples)])
-    
-    prompt = f"""
-    You are Pragaman, a strategic sales architect at Noboru World.
-    Your goal is to draft a hyper-personalized, peer-to-peer outreach sequence.
-    
-    Prospect Details:
-    Name: {lead['first_name']} {lead['last_name']}
-    Title: {lead['title']}
-    Company: {lead['company']}
-    Location: {lead['location']}
-    LinkedIn URL: {lead['linkedin_url'] if lead['linkedin_url'] else "N/A"}
-    Email: {lead['email'] if lead['email'] else "N/A"}
-    Phone: {lead['phone'] if lead['phone'] else "N/A"}
-    
+    global _model
+    if _model is None:
+        _model = genai.GenerativeModel(DRAFT_MODEL)
+    return _model
+
+def select_email_examples(index, lead):
+    """
+    Picks the few-shot examples closest to one lead.
+    """
+    return index.query(lead_query_text(lead), k=FEW_SHOT_EXAMPLES)
+
+def format_examples(examples):
+    return "\n\n".join([f"Example {i+1}:\n{ex}" for i, ex in enumerate(examples)])
+
+# The Noboru Protocol, shared by the single-lead and the batch prompt
+PROTOCOL_GUIDELINES = """
     ### Noboru Protocol V2 Guidelines:
     1. **Inference First**: Based on their Title, infer their top 3 probable pain points.
     2. **Framework**: Use "Observation -> Problem -> Solution".
@@ -44,15 +50,40 @@ def generate_drafts(lead, cursor):
        - If Email is "N/A", set "email_subject" and "email_body" to null.
        - If LinkedIn URL is "N/A", set "linkedin_note" to null.
        - If Phone is "N/A", set "whatsapp_nudge" to null.
+"""
 
-    ### Style Reference (EMULATE THIS FLOW):
-    {email_examples_text if email_examples_text else "No examples provided. Use standard professional tone."}
-    
+DELIVERABLES = """
     ### Deliverables (Only if data available):
     1. **Cold Email**: Subject (lowercase, 2-4 words) + Body (under 75 words).
     2. **LinkedIn Note**: Max 280 chars. Casual.
     3. **WhatsApp Nudge**: Extremely casual.
+"""
+
+def protocol_instructions(email_examples_text):
+    return f"""{PROTOCOL_GUIDELINES}
+    ### Style Reference (EMULATE THIS FLOW):
+    {email_examples_text if email_examples_text else "No examples provided. Use standard professional tone."}
+    {DELIVERABLES}"""
+
+def format_prospect(lead):
+    return f"""
+    Name: {lead['first_name']} {lead['last_name']}
+    Title: {lead['title']}
+    Company: {lead['company']}
+    Location: {lead['location']}
+    LinkedIn URL: {lead['linkedin_url'] if lead['linkedin_url'] else "N/A"}
+    Email: {lead['email'] if lead['email'] else "N/A"}
+    Phone: {lead['phone'] if lead['phone'] else "N/A"}
+    """
+
+def build_prompt(lead, email_examples_text):
+    # Construct the prompt (The "Noboru Protocol")
+    return f"""
+    You are Pragaman, a strategic sales architect at Noboru World.
+    Your goal is to draft a hyper-personalized, peer-to-peer outreach sequence.
     
+    Prospect Details:{format_prospect(lead)}
+    {protocol_instructions(email_examples_text)}
     Output JSON format:
     {{
         "email_subject": "...",
@@ -61,54 +92,258 @@ def generate_drafts(lead, cursor):
         "whatsapp_nudge": "..."
     }}
     """
+
+def build_batch_prompt(leads, examples_by_lead):
+    """
+    Same protocol as build_prompt, but one request drafts several prospects.
+    examples_by_lead: {lead id: examples picked for that lead}. The examples of
+    the whole batch are numbered once and each prospect names its own.
+    """
+    examples = []
+    for lead in leads:
+        for example in examples_by_lead.get(lead['id'], []):
+            if example not in examples:
+                examples.append(example)
+    
+    prospects = []
+    for lead in leads:
+        numbers = [str(examples.index(ex) + 1) for ex in examples_by_lead.get(lead['id'], [])]
+        style = f"Style Reference: Examples {', '.join(numbers)}" if numbers else "Style Reference: standard professional tone"
+        prospects.append(f"\n    Lead ID: {lead['id']}{format_prospect(lead)}{style}\n")
+    prospects_text = "\n".join(prospects)
+    return f"""
+    You are Pragaman, a strategic sales architect at Noboru World.
+    Your goal is to draft a hyper-personalized, peer-to-peer outreach sequence for EACH prospect below.
+    Treat every prospect independently.
+    
+    Prospects:
+    {prospects_text}
+    {protocol_instructions(format_examples(examples))}
+    Write each prospect in the style of the examples listed for it.
+    Output a JSON array with exactly one object per prospect:
+    [
+        {{
+            "lead_id": <Lead ID>,
+            "email_subject": "...",
+            "email_body": "...",
+            "linkedin_note": "...",
+            "whatsapp_nudge": "..."
+        }}
+    ]
+    """
+
+DRAFT_FIELDS = ('email_subject', 'email_body', 'linkedin_note', 'whatsapp_nudge')
+
+def validate_draft(lead, item):
+    """
+    Checks one batch item before it is accepted in place of a single-lead draft.
+    """
+    if not isinstance(item, dict):
+        return False
+    for field in DRAFT_FIELDS:
+        if field not in item or not (item[field] is None or isinstance(item[field], str)):
+            return False
+    # A lead with an email must come back with a usable email draft
+    if lead['email'] and not (item['email_subject'] and item['email_body']):
+        return False
+    return True
+
+def generate_batch_drafts(leads, examples_by_lead, model=None):
+    """
+    Drafts several leads in one Gemini request.
+    Returns {lead_id: drafts} for the items that validated; the rest are left out.
+    """
+    model = model or get_model()
+    prompt = build_batch_prompt(leads, examples_by_lead)
     
     try:
-        response = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        response = call_with_limit("gemini", DRAFT_MODEL, model.generate_content, prompt,
+                                   generation_config={"response_mime_type": "application/json"})
+        items = json.loads(response.text)
+    except Exception as e:
+        print(f"Error generating batch draft for {len(leads)} leads: {e}")
+        return {}
+    
+    if not isinstance(items, list):
+        print("Batch draft was not a JSON array.")
+        return {}
+    
+    leads_by_id = {lead['id']: lead for lead in leads}
+    drafts = {}
+    for item in items:
+        try:
+            lead_id = int(item.get('lead_id'))
+        except (AttributeError, TypeError, ValueError):
+            continue
+        lead = leads_by_id.get(lead_id)
+        if lead and lead_id not in drafts and validate_draft(lead, item):
+            drafts[lead_id] = {field: item[field] for field in DRAFT_FIELDS}
+    return drafts
+
+def generate_drafts(lead, email_examples_text, model=None):
+    """
+    Generates email, LinkedIn note, and WhatsApp nudge using Gemini.
+    email_examples_text is the few-shot examples picked for this lead.
+    """
+    model = model or get_model()
+    
+    prompt = build_prompt(lead, email_examples_text)
+    
+    try:
+        response = call_with_limit("gemini", DRAFT_MODEL, model.generate_content, prompt,
+                                   generation_config={"response_mime_type": "application/json"})
         return json.loads(response.text)
     except Exception as e:
         print(f"Error generating draft for {lead['email']}: {e}")
         return None
 
-def run_drafter():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def draft_batch(leads, examples_by_lead, model):
+    """
+    Worker task: drafts a batch of leads and measures each Gemini request.
+    examples_by_lead: {lead id: few-shot examples picked for that lead}.
+    Leads missing from (or invalid in) the batch reply go through the single-lead path.
+    Returns ([(lead, drafts), ...], [(request seconds, leads in the request), ...]).
+    """
+    results = []
+    latencies = []
+    remaining = list(leads)
     
-    # Fetch leads that need drafting (Status 'Enriched' or 'New')
-    cursor.execute("SELECT * FROM leads WHERE status IN ('Enriched', 'New') AND draft_email_body IS NULL")
-    leads = cursor.fetchall()
+    if len(leads) > 1:
+        start = time.perf_counter()
+        batch_drafts = generate_batch_drafts(leads, examples_by_lead, model)
+        latencies.append((time.perf_counter() - start, len(leads)))
+        remaining = []
+        for lead in leads:
+            if lead['id'] in batch_drafts:
+                results.append((lead, batch_drafts[lead['id']]))
+            else:
+                remaining.append(lead)
+        if remaining:
+            print(f"Batch returned {len(leads) - len(remaining)}/{len(leads)} drafts, retrying the rest individually.")
     
-    print(f"Found {len(leads)} leads to draft.")
+    for lead in remaining:
+        start = time.perf_counter()
+        drafts = generate_drafts(lead, format_examples(examples_by_lead.get(lead['id'], [])), model)
+        latencies.append((time.perf_counter() - start, 1))
+        results.append((lead, drafts))
     
-    for lead in leads:
-        print(f"Drafting for {lead['first_name']} {lead['last_name']}...")
-        drafts = generate_drafts(lead, cursor)
-        
-        if drafts:
-            try:
-                cursor.execute("""
-                UPDATE leads 
-                SET draft_email_subject = ?,
-                    draft_email_body = ?,
-                    draft_linkedin_note = ?,
-                    draft_whatsapp_nudge = ?,
-                    status = 'Pending_Approval',
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-                """, (
-                    drafts.get('email_subject'),
-                    drafts.get('email_body'),
-                    drafts.get('linkedin_note'),
-                    drafts.get('whatsapp_nudge'),
-                    lead['id']
-                ))
-                conn.commit()
-                print("Draft saved.")
-            except sqlite3.Error as e:
-                print(f"Database error: {e}")
+    return results, latencies
+
+def save_drafts(conn, results, worker_id):
+    """
+    Writes a batch of (lead_id, drafts) pairs in a single transaction.
+    Only leads still leased to worker_id are written; their lease is cleared.
+    Returns the number of drafts actually written.
+    """
+    try:
+        with conn:
+            before = conn.total_changes
+            conn.executemany("""
+            UPDATE leads 
+            SET draft_email_subject = ?,
+                draft_email_body = ?,
+                draft_linkedin_note = ?,
+                draft_whatsapp_nudge = ?,
+                status = 'Pending_Approval',
+                claimed_by = NULL,
+                lease_expires_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND claimed_by = ?
+            """, [(
+                drafts.get('email_subject'),
+                drafts.get('email_body'),
+                drafts.get('linkedin_note'),
+                drafts.get('whatsapp_nudge'),
+                lead_id,
+                worker_id
+            ) for lead_id, drafts in results])
+            saved = conn.total_changes - before
+        if saved < len(results):
+            print(f"Saved {saved} drafts; {len(results) - saved} lost their lease to another worker.")
         else:
-            print("Skipping due to generation error.")
-            
-    conn.close()
+            print(f"Saved {saved} drafts.")
+        return saved
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return 0
+
+def latency_summary(values):
+    ordered = sorted(values)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"avg {sum(ordered) / len(ordered):.2f}s, p50 {p50:.2f}s, p95 {p95:.2f}s, max {ordered[-1]:.2f}s"
+
+def print_drafter_stats(latencies, processed, saved, failed, elapsed):
+    """
+    latencies: (request seconds, leads in the request) per Gemini request. A
+    batch request's time is split evenly over its leads for the per-lead figures.
+    """
+    if not latencies:
+        return
+    print(f"Drafted {saved} leads ({failed} failed) in {elapsed:.1f}s "
+          f"- {processed / elapsed:.2f} leads/s, {len(latencies)} Gemini requests")
+    print(f"Per-lead latency: {latency_summary([seconds / count for seconds, count in latencies for _ in range(count)])}")
+    print(f"Per-request latency: {latency_summary([seconds for seconds, _ in latencies])}")
+
+def run_drafter(concurrency=None, batch_size=None):
+    conn = get_db_connection()
+    
+    concurrency = concurrency or DRAFTER_CONCURRENCY
+    batch_size = max(1, batch_size or DRAFTER_BATCH_SIZE)
+    model = get_model()
+    worker_id = make_worker_id("drafter")
+    # Claim a few rounds of work at a time so parallel workers share the backlog
+    claim_size = concurrency * batch_size * 2
+    
+    # Examples are picked here: the connection stays on this (writer) thread
+    index = get_example_index(conn, 'Email')
+    
+    latencies = []
+    processed = 0
+    saved = 0
+    failed = 0
+    start = time.perf_counter()
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                # Failed leads keep their lease until the end of the run, so they are not re-claimed here
+                leads = claim_leads(conn, worker_id, DRAFTABLE, limit=claim_size)
+                if not leads:
+                    break
+                print(f"Claimed {len(leads)} leads to draft.")
+                
+                batches = [leads[i:i + batch_size] for i in range(0, len(leads), batch_size)]
+                examples_by_lead = {lead['id']: select_email_examples(index, lead) for lead in leads}
+                futures = [pool.submit(draft_batch, batch, examples_by_lead, model) for batch in batches]
+                pending = []
+                
+                for future in as_completed(futures):
+                    results, batch_latencies = future.result()
+                    latencies.extend(batch_latencies)
+                    
+                    for lead, drafts in results:
+                        processed += 1
+                        if drafts:
+                            print(f"Drafted {lead['first_name']} {lead['last_name']}")
+                            pending.append((lead['id'], drafts))
+                        else:
+                            failed += 1
+                            print(f"Skipping {lead['first_name']} {lead['last_name']} due to generation error.")
+                    
+                    if len(pending) >= DRAFTER_WRITE_BATCH:
+                        saved += save_drafts(conn, pending, worker_id)
+                        pending = []
+                
+                if pending:
+                    saved += save_drafts(conn, pending, worker_id)
+    finally:
+        release_leads(conn, worker_id)
+        conn.close()
+    
+    if not processed:
+        print("Found 0 leads to draft.")
+    print_drafter_stats(latencies, processed, saved, failed, time.perf_counter() - start)
 
 if __name__ == "__main__":
     run_drafter()
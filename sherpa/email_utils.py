@@ -0,0 +1,137 @@
+import base64
+import re
+from email.utils import parseaddr
+from html.parser import HTMLParser
+
+from config import REPLY_BODY_MAX_CHARS
+from reply_rules import strip_quoted_history, strip_signature
+
+# Providers that ignore dots in the local part
+DOTLESS_DOMAINS = {'gmail.com', 'googlemail.com'}
+
+def normalize_email(value):
+    """
+    Normalizes an address or a From header ('Jane <Jane+x@Example.com>') for matching:
+    lowercased, display name and +tag dropped, Gmail dots ignored.
+    Returns None if no address can be parsed.
+    """
+    if not value:
+        return None
+    _, address = parseaddr(str(value))
+    address = address.strip().lower()
+    if address.count('@') != 1:
+        return None
+    local, domain = address.split('@')
+    local = local.split('+', 1)[0]
+    if domain == 'googlemail.com':
+        domain = 'gmail.com'
+    if domain in DOTLESS_DOMAINS:
+        local = local.replace('.', '')
+    if not local or not domain:
+        return None
+    return f"{local}@{domain}"
+
+class _HTMLText(HTMLParser):
+    """
+    Collects visible text; drops scripts, styles and quoted (blockquote / gmail_quote) blocks.
+    """
+    SKIP_TAGS = {'script', 'style', 'head', 'blockquote'}
+    BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'h1', 'h2', 'h3', 'h4'}
+    # Tags without an end tag; they never open or close a skipped block
+    VOID_TAGS = {'br', 'img', 'hr', 'meta', 'link', 'input', 'wbr', 'col', 'area', 'base', 'source'}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        classes = dict(attrs).get('class') or ''
+        if self.skip_depth or tag in self.SKIP_TAGS or 'gmail_quote' in classes:
+            self.skip_depth += tag not in self.VOID_TAGS
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, <img/>: no end tag follows, so the skip depth stays as it is
+        if not self.skip_depth and tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if self.skip_depth and tag not in self.VOID_TAGS:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+def html_to_text(html):
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    text = ''.join(parser.parts)
+    return re.sub(r'\n\s*\n+', '\n\n', re.sub(r'[ \t]+', ' ', text)).strip()
+
+def _header(part, name):
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), '')
+
+def _is_attachment(part):
+    # Gmail also moves large inline bodies behind an attachmentId, so that alone does not count
+    return bool(part.get('filename')) or _header(part, 'content-disposition').lower().startswith('attachment')
+
+def _decode_part(part, max_chars, fetch_attachment=None):
+    """
+    Decodes only as much base64 as max_chars of text can need (4 bytes per char worst case).
+    A body Gmail stored by attachmentId is fetched with fetch_attachment(attachment_id).
+    """
+    body = part.get('body', {})
+    data = body.get('data')
+    if not data and body.get('attachmentId') and fetch_attachment:
+        data = fetch_attachment(body['attachmentId'])
+    data = data or ''
+    max_b64 = -(-max_chars * 4 // 3) * 4
+    data = data[:max_b64]
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    charset = re.search(r'charset="?([\w-]+)', _header(part, 'content-type'), re.IGNORECASE)
+    try:
+        return raw.decode(charset.group(1) if charset else 'utf-8', errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+def find_text_parts(payload):
+    """
+    Walks the MIME tree (depth first) and returns (first text/plain, first text/html)
+    inline parts. Attachments (a filename or an attachment disposition) are never
+    decoded or downloaded.
+    """
+    plain = html = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        mime_type = part.get('mimeType', '').lower()
+        if mime_type.startswith('multipart/'):
+            stack.extend(reversed(part.get('parts', [])))
+        elif _is_attachment(part) or not (part.get('body', {}).get('data') or part.get('body', {}).get('attachmentId')):
+            continue
+        elif mime_type == 'text/plain' and plain is None:
+            plain = part
+        elif mime_type == 'text/html' and html is None:
+            html = part
+    return plain, html
+
+def extract_reply_text(payload, max_chars=REPLY_BODY_MAX_CHARS, fetch_attachment=None):
+    """
+    Best reply text from a Gmail message payload: text/plain, else text/html
+    converted to text; quoted history and signature stripped, capped at max_chars.
+    fetch_attachment(attachment_id) returns the base64 data of an inline body
+    Gmail did not include in the payload.
+    """
+    plain, html = find_text_parts(payload)
+    if plain is not None:
+        text = _decode_part(plain, max_chars, fetch_attachment)
+    elif html is not None:
+        # Markup inflates the size, so allow more raw HTML than text
+        text = html_to_text(_decode_part(html, max_chars * 4, fetch_attachment))
+    else:
+        return ''
+    return strip_signature(strip_quoted_history(text))[:max_chars]
@@ -0,0 +1,58 @@
+import json
+
+from config import ENRICHMENT_CACHE_TTL_DAYS, ENRICHMENT_NEGATIVE_TTL_DAYS
+
+# Apollo answers keyed by canonical LinkedIn URL (see linkedin_urls.py), raw
+# person JSON included. Misses (no match, or a match without an email) are
+# stored too, so the same profile is not paid for again until
+# ENRICHMENT_NEGATIVE_TTL_DAYS pass. Errors are never cached.
+
+def get_cached(conn, keys):
+    """
+    Returns {key: person dict, or None for a cached miss} for the keys with a fresh entry.
+    """
+    cached = {}
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for key, response in conn.execute(f"""
+            SELECT linkedin_key, response FROM enrichment_cache
+            WHERE linkedin_key IN ({placeholders})
+              AND fetched_at > datetime('now', CASE WHEN found THEN ? ELSE ? END)
+        """, (*chunk, f"-{ENRICHMENT_CACHE_TTL_DAYS} days", f"-{ENRICHMENT_NEGATIVE_TTL_DAYS} days")):
+            cached[key] = json.loads(response) if response else None
+    return cached
+
+def store(conn, results):
+    """
+    Saves {key: person dict or None}; a person without an email counts as a miss.
+    """
+    with conn:
+        conn.executemany("""
+            INSERT INTO enrichment_cache (linkedin_key, response, found, fetched_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(linkedin_key) DO UPDATE SET
+                response = excluded.response, found = excluded.found, fetched_at = excluded.fetched_at
+        """, [(key, json.dumps(person) if person else None, 1 if person and person.get("email") else 0)
+              for key, person in results.items()])
+
+def purge(conn, misses_only=False, expired_only=False):
+    """
+    Deletes cache entries: all of them, only misses, and/or only expired ones.
+    Returns the number deleted.
+    """
+    conditions = []
+    params = []
+    if misses_only:
+        conditions.append("found = 0")
+    if expired_only:
+        conditions.append("fetched_at <= datetime('now', CASE WHEN found THEN ? ELSE ? END)")
+        params += [f"-{ENRICHMENT_CACHE_TTL_DAYS} days", f"-{ENRICHMENT_NEGATIVE_TTL_DAYS} days"]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with conn:
+        return conn.execute(f"DELETE FROM enrichment_cache {where}", params).rowcount
+
+def cache_stats(conn):
+    hits, misses = conn.execute("SELECT COALESCE(SUM(found), 0), COALESCE(SUM(1 - found), 0) FROM enrichment_cache").fetchone()
+    return {"hits": hits, "misses": misses}
@@ -0,0 +1,109 @@
+import math
+import random
+import re
+import zlib
+from collections import Counter
+
+from config import EXAMPLE_CONTEXT_BOOST
+
+# Hashed feature space for word unigrams + bigrams (no vocabulary to keep in sync)
+N_FEATURES = 2 ** 18
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# type -> (signature, ExampleIndex); lives as long as the process (e.g. the dashboard)
+_indexes = {}
+
+def tokenize(text):
+    """
+    Lowercase word tokens with a light plural strip, so 'CEOs' matches 'CEO'.
+    """
+    tokens = []
+    for token in TOKEN_RE.findall((text or "").lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+def hashed_features(text):
+    tokens = tokenize(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    return Counter(zlib.crc32(g.encode()) % N_FEATURES for g in grams)
+
+def _normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return {}
+    return {f: v / norm for f, v in vector.items()}
+
+class ExampleIndex:
+    """
+    TF-IDF index over one type of training example.
+    Rows are (id, content, context); context terms are weighted by context_boost.
+    """
+    def __init__(self, rows, context_boost=EXAMPLE_CONTEXT_BOOST):
+        self.rows = list(rows)
+        docs = [(hashed_features(content), hashed_features(context)) for _, content, context in self.rows]
+
+        df = Counter()
+        for content_tf, context_tf in docs:
+            df.update(set(content_tf) | set(context_tf))
+        n = len(docs)
+        self.idf = {f: math.log((1 + n) / (1 + count)) + 1 for f, count in df.items()}
+
+        self.vectors = []
+        for content_tf, context_tf in docs:
+            vector = Counter()
+            for f, tf in content_tf.items():
+                vector[f] += tf * self.idf[f]
+            for f, tf in context_tf.items():
+                vector[f] += context_boost * tf * self.idf[f]
+            self.vectors.append(_normalize(vector))
+
+    def query(self, text, k=2):
+        """
+        Returns the content of the k examples closest to text.
+        Slots nothing overlaps with are filled by a random pick, as before.
+        """
+        query_vector = _normalize({f: tf * self.idf[f] for f, tf in hashed_features(text).items() if f in self.idf})
+        scored = []
+        unscored = []
+        for i, vector in enumerate(self.vectors):
+            score = sum(w * vector.get(f, 0.0) for f, w in query_vector.items())
+            if score > 0:
+                scored.append((score, i))
+            else:
+                unscored.append(i)
+        scored.sort(reverse=True)
+        picked = [i for _, i in scored[:k]]
+        if len(picked) < k and unscored:
+            picked += random.sample(unscored, min(k - len(picked), len(unscored)))
+        return [self.rows[i][1] for i in picked]
+
+def lead_query_text(lead):
+    return " ".join(str(lead[key]) for key in ('title', 'company', 'location') if lead[key])
+
+def _signature(conn, ex_type):
+    # Adding or deleting an example always changes one of these
+    return tuple(conn.execute("SELECT COUNT(*), MAX(id) FROM examples WHERE type = ?", (ex_type,)).fetchone())
+
+def get_example_index(conn, ex_type='Email'):
+    """
+    Returns the cached index for ex_type, rebuilding it only if examples were added or deleted.
+    """
+    signature = _signature(conn, ex_type)
+    cached = _indexes.get(ex_type)
+    if cached and cached[0] == signature:
+        return cached[1]
+    rows = conn.execute("SELECT id, content, context FROM examples WHERE type = ?", (ex_type,)).fetchall()
+    index = ExampleIndex([tuple(row) for row in rows])
+    _indexes[ex_type] = (signature, index)
+    return index
+
+def invalidate(ex_type=None):
+    """
+    Drops cached indexes (all of them if ex_type is None). Called by "Train Sherpa".
+    """
+    if ex_type is None:
+        _indexes.clear()
+    else:
+        _indexes.pop(ex_type, None)
@@ -0,0 +1,106 @@
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
+
+from config import GMAIL_ACCOUNTS, GMAIL_ACCOUNT_MAX_FAILURES, GMAIL_ACCOUNT_COOLDOWN_SECONDS
+from dispatch import ChannelUnavailable
+
+# Sending accounts come from GMAIL_ACCOUNTS (name -> token file); their health
+# lives in the gmail_accounts table. Leads are pinned to one account through
+# leads.sender_account so every message to a lead comes from the same mailbox.
+
+def account_names():
+    return list(GMAIL_ACCOUNTS)
+
+def token_file(account):
+    return GMAIL_ACCOUNTS[account]
+
+def ensure_accounts(conn):
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO gmail_accounts (name) VALUES (?)",
+                         [(name,) for name in account_names()])
+
+def healthy_accounts(conn):
+    """
+    Configured accounts that are not cooling down after repeated failures.
+    """
+    ensure_accounts(conn)
+    cooling = {row[0] for row in conn.execute(
+        "SELECT name FROM gmail_accounts WHERE disabled_until IS NOT NULL AND disabled_until > datetime('now')")}
+    return [name for name in account_names() if name not in cooling]
+
+def record_success(conn, account):
+    conn.execute("""
+        UPDATE gmail_accounts SET consecutive_failures = 0, disabled_until = NULL, last_error = NULL,
+            last_sent_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE name = ?
+    """, (account,))
+
+def is_account_error(error):
+    """
+    Whether a failed send says something about the account rather than the
+    message: auth and quota errors (401, 403, 429), Gmail server errors (5xx),
+    a token that cannot be refreshed, or a mailbox that could not be opened.
+    """
+    if isinstance(error, (RefreshError, ChannelUnavailable)):
+        return True
+    if isinstance(error, HttpError):
+        status = int(error.resp.status)
+        return status in (401, 403, 429) or status >= 500
+    return False
+
+def record_failure(conn, account, error):
+    """
+    Counts a failed send (only account errors, see is_account_error); after
+    GMAIL_ACCOUNT_MAX_FAILURES in a row the account cools down for
+    GMAIL_ACCOUNT_COOLDOWN_SECONDS and gets no new leads.
+    """
+    conn.execute("""
+        UPDATE gmail_accounts
+        SET consecutive_failures = consecutive_failures + 1, last_error = ?, updated_at = CURRENT_TIMESTAMP,
+            disabled_until = CASE WHEN consecutive_failures + 1 >= ? THEN datetime('now', ?) ELSE disabled_until END
+        WHERE name = ?
+    """, (error, GMAIL_ACCOUNT_MAX_FAILURES, f"+{GMAIL_ACCOUNT_COOLDOWN_SECONDS} seconds", account))
+
+def assign_accounts(conn):
+    """
+    Pins every lead with a pending email to a sending account, picking the healthy
+    account with the fewest leads. Leads keep an account once they have one,
+    unless it was removed from GMAIL_ACCOUNTS. Returns the number of leads assigned.
+    """
+    accounts = healthy_accounts(conn)
+    if not accounts:
+        return 0
+    placeholders = ",".join("?" * len(account_names()))
+    lead_ids = [row[0] for row in conn.execute(f"""
+        SELECT DISTINCT l.id FROM leads l JOIN outbox o ON o.lead_id = l.id
+        WHERE o.channel = 'email' AND o.state = 'pending'
+          AND (l.sender_account IS NULL OR l.sender_account NOT IN ({placeholders}))
+        ORDER BY l.id
+    """, tuple(account_names()))]
+    if not lead_ids:
+        return 0
+    load = {name: 0 for name in accounts}
+    for name, count in conn.execute("SELECT sender_account, COUNT(*) FROM leads WHERE sender_account IS NOT NULL GROUP BY sender_account"):
+        if name in load:
+            load[name] = count
+    assignments = []
+    for lead_id in lead_ids:
+        account = min(accounts, key=lambda name: load[name])
+        load[account] += 1
+        assignments.append((account, lead_id))
+    with conn:
+        conn.executemany("UPDATE leads SET sender_account = ? WHERE id = ?", assignments)
+    return len(assignments)
+
+def account_status(conn):
+    """
+    Returns [{name, consecutive_failures, disabled_until, last_error, last_sent_at}] for configured accounts.
+    """
+    ensure_accounts(conn)
+    rows = {row[0]: row for row in conn.execute(
+        "SELECT name, consecutive_failures, disabled_until, last_error, last_sent_at FROM gmail_accounts")}
+    return [
+        {"name": name, "consecutive_failures": rows[name][1], "disabled_until": rows[name][2],
+         "last_error": rows[name][3], "last_sent_at": rows[name][4]}
+        for name in account_names()
+    ]
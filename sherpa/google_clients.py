@@ -0,0 +1,95 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build, build_from_document
+
+# Sender and listener share one token per account, so it carries every scope either needs.
+# If modifying these scopes, delete the token files; the next run asks for consent once.
+SCOPES = [
+    'https://www.googleapis.com/auth/gmail.send',
+    'https://www.googleapis.com/auth/gmail.readonly',
+    'https://www.googleapis.com/auth/gmail.modify',
+]
+CLIENT_SECRETS_FILE = 'credentials.json'
+# Tokens are refreshed this long before they expire, so no request waits on a refresh
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_credentials = {} # token file -> Credentials
+_credentials_lock = threading.Lock()
+_documents = {} # (api, version) -> discovery document
+_local = threading.local()
+
+def _expires_soon(creds):
+    # google-auth keeps expiry as naive UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry is not None and creds.expiry - now < REFRESH_MARGIN
+
+def _save(creds, token_file):
+    with open(token_file, 'w') as token:
+        token.write(creds.to_json())
+
+def _load(token_file):
+    if not os.path.exists(token_file):
+        return None
+    creds = Credentials.from_authorized_user_file(token_file)
+    # Tokens granted before the scopes were combined need one more consent
+    return creds if creds.has_scopes(SCOPES) else None
+
+def get_credentials(token_file='token.json'):
+    """
+    Credentials for a token file: read once per process, then served from memory
+    and refreshed ahead of expiry. Runs the OAuth flow only when there is no
+    usable token. Returns None if credentials.json is needed but missing.
+    """
+    with _credentials_lock:
+        creds = _credentials.get(token_file) or _load(token_file)
+        if creds and creds.refresh_token and (not creds.valid or _expires_soon(creds)):
+            creds.refresh(Request())
+            _save(creds, token_file)
+        if not creds or not creds.valid:
+            if not os.path.exists(CLIENT_SECRETS_FILE):
+                print("Error: credentials.json not found. Please download it from Google Cloud Console.")
+                return None
+            flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_FILE, SCOPES)
+            creds = flow.run_local_server(port=0)
+            _save(creds, token_file)
+        _credentials[token_file] = creds
+        return creds
+
+def _discovery_document(api, version):
+    key = (api, version)
+    if key not in _documents:
+        try:
+            from googleapiclient.discovery_cache import get_static_doc
+            _documents[key] = get_static_doc(api, version)
+        except ImportError:
+            _documents[key] = None
+    return _documents[key]
+
+def get_service(api, version, token_file='token.json'):
+    """
+    A Google API client, built once per thread and token file (its httplib2
+    connection is not thread-safe, but is kept alive between calls) from a
+    discovery document loaded once per process. Returns None without credentials.
+    """
+    creds = get_credentials(token_file)
+    if creds is None:
+        return None
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = {}
+    key = (api, version, token_file)
+    if key not in services:
+        document = _discovery_document(api, version)
+        if document:
+            services[key] = build_from_document(document, credentials=creds)
+        else:
+            services[key] = build(api, version, credentials=creds, cache_discovery=False)
+    return services[key]
+
+def get_gmail_service(token_file='token.json'):
+    return get_service('gmail', 'v1', token_file)
@@ -0,0 +1,197 @@
+import re
+
+from config import INGEST_CHUNK_SIZE
+from linkedin_urls import canonical_linkedin_url
+
+# Every way a lead enters the database (bridge, manual form, file upload, AI
+# discovery) goes through ingest_leads. A lead is identified by its canonical
+# LinkedIn profile, else its LinkedIn URL as given (e.g. a company page), else
+# its email, else its phone number; a lead that is already known only has its
+# blank fields filled in, never overwritten. Two leads with different canonical
+# profiles are never merged, even when they share an email or phone (e.g. a
+# company inbox or switchboard).
+
+LEAD_FIELDS = ["first_name", "last_name", "email", "phone", "linkedin_url", "company", "title", "location"]
+# Values that mean "unknown" in uploads and AI output
+PLACEHOLDERS = {"", "n/a", "na", "none", "null", "nan", "-", "unknown"}
+
+def clean_value(value):
+    """
+    Stripped string, or None for empty/placeholder values (including pandas NaN).
+    Whole floats (phone numbers read by pandas) lose their '.0'.
+    """
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if value != value: # NaN
+            return None
+        if value.is_integer():
+            value = int(value)
+    value = str(value).strip()
+    return None if value.lower() in PLACEHOLDERS else value
+
+def normalize_lead(lead, status, verification_status):
+    normalized = {field: clean_value(lead.get(field)) for field in LEAD_FIELDS}
+    normalized["linkedin_key"] = canonical_linkedin_url(normalized["linkedin_url"])
+    normalized["status"] = clean_value(lead.get("status")) or status
+    normalized["verification_status"] = clean_value(lead.get("verification_status")) or verification_status
+    return normalized
+
+def identities(lead):
+    """
+    The keys a lead can be matched on, strongest first.
+    """
+    keys = []
+    if lead["linkedin_key"]:
+        keys.append(("key", lead["linkedin_key"]))
+    if lead["linkedin_url"]:
+        keys.append(("url", lead["linkedin_url"]))
+    if lead["email"]:
+        keys.append(("email", lead["email"].lower()))
+    digits = re.sub(r"\D", "", lead["phone"] or "")
+    if len(digits) >= 7:
+        keys.append(("phone", digits))
+    return keys
+
+def _other_profile(linkedin_key, other_key):
+    return bool(linkedin_key and other_key and linkedin_key != other_key)
+
+class LeadIndex:
+    """
+    Identity -> lead id for every lead in the database, loaded in one scan and
+    extended as rows are inserted.
+    """
+    def __init__(self, conn):
+        self.ids = {}
+        self.linkedin_keys = {} # lead id -> canonical profile, for leads that have one
+        self.max_id = 0
+        self.refresh(conn)
+
+    def refresh(self, conn):
+        rows = conn.execute("""
+            SELECT id, linkedin_key, linkedin_url, email, phone FROM leads WHERE id > ? ORDER BY id
+        """, (self.max_id,)).fetchall()
+        for lead_id, linkedin_key, linkedin_url, email, phone in rows:
+            lead = {"linkedin_key": linkedin_key, "linkedin_url": clean_value(linkedin_url),
+                    "email": clean_value(email), "phone": clean_value(phone)}
+            for identity in identities(lead):
+                self.ids.setdefault(identity, lead_id)
+            if linkedin_key:
+                self.linkedin_keys[lead_id] = linkedin_key
+            self.max_id = lead_id
+
+    def find(self, keys, linkedin_key=None):
+        """
+        The lead id of the strongest matching identity, skipping leads with
+        another canonical profile than linkedin_key.
+        """
+        for identity in keys:
+            lead_id = self.ids.get(identity)
+            if lead_id is not None and not _other_profile(linkedin_key, self.linkedin_keys.get(lead_id)):
+                return lead_id
+        return None
+
+def _fill_blanks(target, source):
+    for field, value in source.items():
+        if value and not target.get(field):
+            target[field] = value
+
+def _write_chunk(conn, index, new_leads, known_leads, counts):
+    """
+    Inserts new_leads and fills blank fields of the existing leads in
+    known_leads ({lead id: merged lead}) in one transaction.
+    """
+    columns = LEAD_FIELDS + ["linkedin_key", "status", "verification_status"]
+    with conn:
+        if known_leads:
+            fill_columns = LEAD_FIELDS + ["linkedin_key"]
+            ids = list(known_leads)
+            updates = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for row in conn.execute(f"""
+                    SELECT id, {', '.join(fill_columns)} FROM leads WHERE id IN ({','.join('?' * len(chunk))})
+                """, chunk):
+                    lead = known_leads[row[0]]
+                    current = dict(zip(fill_columns, row[1:]))
+                    filled = {column: lead[column] for column in fill_columns
+                              if lead[column] and not clean_value(current[column])}
+                    if filled:
+                        current.update(filled)
+                        updates.append([current[column] for column in fill_columns] + [row[0]])
+            before = conn.total_changes
+            # OR IGNORE: a value another lead already owns (unique URL/key) leaves that row as it was
+            conn.executemany(f"""
+                UPDATE OR IGNORE leads SET {', '.join(f"{column} = ?" for column in fill_columns)}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, updates)
+            counts["updated"] += conn.total_changes - before
+        if new_leads:
+            before = conn.total_changes
+            conn.executemany(f"""
+                INSERT INTO leads ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                ON CONFLICT DO NOTHING
+            """, [[lead[column] for column in columns] for lead in new_leads])
+            counts["inserted"] += conn.total_changes - before
+    index.refresh(conn)
+
+def ingest_leads(conn, leads, status="Enriched", verification_status=None, require_name=False,
+                 chunk_size=INGEST_CHUNK_SIZE, index=None):
+    """
+    Normalizes and saves an iterable of lead dicts (keys as in LEAD_FIELDS;
+    status/verification_status default to the arguments; require_name rejects
+    leads without a first name). Leads are deduped
+    within the input and against the database, and written with executemany,
+    one transaction per chunk_size leads. Callers that ingest one input in
+    several calls can pass the same LeadIndex to skip reloading it.
+
+    Returns {"inserted", "updated", "skipped", "rejects"}; rejects is a list of
+    (position in the input, reason) for every lead that was not saved on its own.
+    """
+    counts = {"inserted": 0, "updated": 0, "skipped": 0, "rejects": []}
+    if index is None:
+        index = LeadIndex(conn)
+    total = 0
+    chunk_positions = {}
+    new_leads = []
+    known_leads = {}
+
+    def flush():
+        _write_chunk(conn, index, new_leads, known_leads, counts)
+        new_leads.clear()
+        known_leads.clear()
+        chunk_positions.clear()
+
+    for position, raw in enumerate(leads):
+        total += 1
+        lead = normalize_lead(raw, status, verification_status)
+        keys = identities(lead)
+        if not keys:
+            counts["rejects"].append((position, "no email, phone or LinkedIn URL"))
+            continue
+        if require_name and not lead["first_name"]:
+            counts["rejects"].append((position, "no first name"))
+            continue
+        lead_id = index.find(keys, lead["linkedin_key"])
+        if lead_id is not None:
+            if lead_id in known_leads:
+                counts["rejects"].append((position, "duplicate of an earlier row"))
+            else:
+                counts["rejects"].append((position, "already in the database"))
+            _fill_blanks(known_leads.setdefault(lead_id, dict(lead)), lead)
+            continue
+        first = next((chunk_positions[identity] for identity in keys if identity in chunk_positions
+                      and not _other_profile(lead["linkedin_key"], new_leads[chunk_positions[identity]]["linkedin_key"])), None)
+        if first is not None:
+            counts["rejects"].append((position, "duplicate of an earlier row"))
+            _fill_blanks(new_leads[first], lead)
+        else:
+            first = len(new_leads)
+            new_leads.append(lead)
+        for identity in identities(new_leads[first]):
+            chunk_positions.setdefault(identity, first)
+        if len(new_leads) + len(known_leads) >= chunk_size:
+            flush()
+    flush()
+    counts["skipped"] = total - counts["inserted"] - counts["updated"]
+    return counts
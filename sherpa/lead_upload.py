@@ -0,0 +1,80 @@
+import pandas as pd
+
+from config import INGEST_CHUNK_SIZE
+from ingest import LEAD_FIELDS
+
+# Upload Leads: spreadsheet columns are matched to lead fields by name (case-insensitive)
+COLUMN_ALIASES = {
+    "full_name": ['name', 'full name', 'fullname'],
+    "first_name": ['first name', 'firstname', 'first_name'],
+    "last_name": ['last name', 'lastname', 'last_name'],
+    "email": ['email', 'email address'],
+    "linkedin_url": ['linkedin', 'linkedin url', 'linkedin_url', 'profile'],
+    "company": ['company', 'company name'],
+    "title": ['title', 'job title', 'role'],
+    "location": ['location', 'city', 'country'],
+    "phone": ['phone', 'phone number', 'mobile'],
+}
+
+def resolve_columns(columns):
+    """
+    Returns {field: file column or None}, resolved once per file.
+    """
+    by_name = {str(column).strip().lower(): column for column in columns}
+    return {
+        field: next((by_name[alias] for alias in aliases if alias in by_name), None)
+        for field, aliases in COLUMN_ALIASES.items()
+    }
+
+def preview_lead_file(uploaded_file, rows=5):
+    if uploaded_file.name.endswith('.csv'):
+        preview = pd.read_csv(uploaded_file, dtype=str, nrows=rows)
+    else:
+        preview = pd.read_excel(uploaded_file, dtype=str, nrows=rows)
+    uploaded_file.seek(0)
+    return preview
+
+def read_lead_file(uploaded_file, chunksize=INGEST_CHUNK_SIZE):
+    """
+    Yields (DataFrame of at most chunksize rows, fraction of the file read),
+    every cell read as text (so phone numbers keep their leading zeros).
+    CSVs are streamed; Excel files are read whole and then sliced.
+    """
+    if uploaded_file.name.endswith('.csv'):
+        for chunk in pd.read_csv(uploaded_file, dtype=str, chunksize=chunksize):
+            yield chunk, min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0)
+    else:
+        df = pd.read_excel(uploaded_file, dtype=str)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize], min((start + chunksize) / len(df), 1.0)
+
+def map_leads(chunk, columns):
+    """
+    Builds one lead dict per row of chunk from the resolved columns, as column
+    operations: a 'Name' column is split into first and last name; otherwise
+    the first/last name columns are used.
+    """
+    leads = pd.DataFrame(index=chunk.index)
+    for field in LEAD_FIELDS:
+        source = columns.get(field)
+        leads[field] = chunk[source].str.strip() if source is not None else None
+    if columns["full_name"] is not None:
+        names = chunk[columns["full_name"]].str.strip()
+        has_name = names.notna() & (names != "")
+        parts = names.str.split(" ", n=1, expand=True).reindex(columns=[0, 1])
+        leads.loc[has_name, "first_name"] = parts.loc[has_name, 0]
+        leads.loc[has_name, "last_name"] = parts.loc[has_name, 1].fillna("")
+    return leads.astype(object).where(leads.notna(), None).to_dict("records")
+
+def reject_rows(chunk, rejects):
+    """
+    The rows of chunk that ingest_leads rejected, with their spreadsheet row
+    number (header = row 1) and the reason.
+    """
+    if not rejects:
+        return None
+    positions, reasons = zip(*rejects)
+    rows = chunk.iloc[list(positions)].copy()
+    rows.insert(0, "reason", reasons)
+    rows.insert(0, "row", rows.index + 2)
+    return rows
@@ -0,0 +1,41 @@
+import os
+import socket
+import uuid
+
+from config import LEASE_SECONDS
+
+def make_worker_id(role):
+    """
+    Unique id for one worker process, e.g. 'drafter@host:1234:9f2c1a'.
+    """
+    return f"{role}@{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+def claim_leads(conn, worker_id, condition, params=(), limit=50, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically claims up to `limit` leads matching `condition` (an SQL WHERE fragment).
+    Rows whose lease has expired are reclaimable. Returns the claimed rows.
+    """
+    with conn:
+        return conn.execute(f"""
+            UPDATE leads
+            SET claimed_by = ?, lease_expires_at = datetime('now', ?)
+            WHERE id IN (
+                SELECT id FROM leads
+                WHERE ({condition})
+                  AND (claimed_by IS NULL OR lease_expires_at IS NULL OR lease_expires_at < datetime('now'))
+                ORDER BY id
+                LIMIT ?
+            )
+            RETURNING *
+        """, (worker_id, f"+{lease_seconds} seconds", *params, limit)).fetchall()
+
+def release_leads(conn, worker_id, lead_ids=None):
+    """
+    Releases leases held by worker_id (all of them if lead_ids is None).
+    """
+    with conn:
+        if lead_ids is None:
+            conn.execute("UPDATE leads SET claimed_by = NULL, lease_expires_at = NULL WHERE claimed_by = ?", (worker_id,))
+        else:
+            conn.executemany("UPDATE leads SET claimed_by = NULL, lease_expires_at = NULL WHERE id = ? AND claimed_by = ?",
+                             [(lead_id, worker_id) for lead_id in lead_ids])
@@ -0,0 +1,33 @@
+import re
+from urllib.parse import urlsplit, unquote
+
+# /in/<slug> and everything after it (/overlay/..., /details/..., /recent-activity/...)
+PROFILE_PATH = re.compile(r"^/in/([^/]+)")
+# Old public profile URLs: /pub/<name>/<a>/<b>/<c>
+PUBLIC_PROFILE_PATH = re.compile(r"^/pub/[^/]+(?:/[^/]+){0,3}")
+
+def canonical_linkedin_url(url):
+    """
+    One spelling per LinkedIn member profile, used as the dedupe and cache key:
+    'http://uk.linkedin.com/in/Jane-Doe/?miniProfileUrn=x' -> 'https://www.linkedin.com/in/jane-doe'.
+    Scheme, locale subdomain, trailing slash, query, fragment, case and
+    percent-encoding are normalized away. Returns None for anything that is not
+    a member profile (empty values, 'N/A', company pages, other sites).
+    """
+    if not url or not str(url).strip():
+        return None
+    url = str(url).strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower().rsplit("@", 1)[-1].split(":")[0]
+    if host != "linkedin.com" and not host.endswith(".linkedin.com"):
+        return None
+    path = re.sub(r"/{2,}", "/", unquote(parts.path)).rstrip("/").lower()
+    match = PROFILE_PATH.match(path)
+    if match:
+        return f"https://www.linkedin.com/in/{match.group(1)}"
+    match = PUBLIC_PROFILE_PATH.match(path)
+    if match:
+        return f"https://www.linkedin.com{match.group(0)}"
+    return None
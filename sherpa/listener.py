@@ -1,47 +1,30 @@
-import os.path
-import base64
 import sqlite3
 import json
 import google.generativeai as genai
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from config import DB_PATH, GEMINI_API_KEY
+from googleapiclient.errors import HttpError
+from config import DB_PATH, GEMINI_API_KEY, LISTENER_FULL_SCAN_LIMIT, GMAIL_BATCH_SIZE, LISTENER_KNOWN_THREADS_ONLY
+from google_clients import get_gmail_service
+from rate_limiter import call_with_limit
+from sync_state import get_state, set_state
+from gmail_accounts import account_names, token_file
+from email_utils import normalize_email, extract_reply_text
+from reply_rules import CATEGORIES, pre_classify, strip_quoted_history, body_hash
 
 # Configure Gemini
 genai.configure(api_key=GEMINI_API_KEY)
 
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.modify']
+HISTORY_ID_KEY = 'gmail_history_id' # One key per account: 'gmail_history_id:<account>'
+# batchModify accepts at most this many ids
+BATCH_MODIFY_LIMIT = 1000
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_gmail_service():
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists('credentials.json'):
-                print("Error: credentials.json not found.")
-                return None
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    service = build('gmail', 'v1', credentials=creds)
-    return service
-
-def classify_reply(email_body):
+def classify_with_gemini(email_body):
     """
-    Uses Gemini to classify the reply.
+    Asks Gemini for a category. Raises on API errors; unknown answers map to OTHER.
     """
     model = genai.GenerativeModel('gemini-2.0-flash')
     prompt = f"""
@@ -57,59 +40,231 @@ def classify_reply(email_body):
     
     Output only the category name.
     """
+    response = call_with_limit("gemini", "gemini-2.0-flash", model.generate_content, prompt)
+    category = response.text.strip().upper()
+    return category if category in CATEGORIES else "OTHER"
+
+def classify_reply(conn, headers, email_body):
+    """
+    Classifies a reply: header/keyword rules first, then the cache, then Gemini.
+    Returns (category, source).
+    """
+    category = pre_classify(headers, email_body)
+    if category:
+        return category, "rules"
+
+    key = body_hash(email_body)
+    row = conn.execute("SELECT category FROM classification_cache WHERE body_hash = ?", (key,)).fetchone()
+    if row:
+        return row[0], "cache"
+
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip().upper()
+        category = classify_with_gemini(strip_quoted_history(email_body))
     except Exception as e:
         print(f"Error classifying reply: {e}")
-        return "OTHER"
+        return "OTHER", "error"
+
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO classification_cache (body_hash, category) VALUES (?, ?)", (key, category))
+    return category, "gemini"
+
+def fetch_history(service, start_history_id, account=None):
+    """
+    Returns ([{'id', 'threadId'}, ...], latest_history_id) for unread inbox
+    messages added since start_history_id, or (None, None) if that history has expired.
+    """
+    messages = []
+    seen = set()
+    page_token = None
+    while True:
+        try:
+            response = call_with_limit("gmail", account, service.users().history().list(
+                userId='me', startHistoryId=start_history_id, historyTypes=['messageAdded'],
+                labelId='INBOX', pageToken=page_token).execute)
+        except HttpError as e:
+            if e.resp.status == 404:
+                print("Gmail history expired, falling back to a full scan.")
+                return None, None
+            raise
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added['message']
+                if 'UNREAD' in message.get('labelIds', []) and message['id'] not in seen:
+                    seen.add(message['id'])
+                    messages.append({'id': message['id'], 'threadId': message.get('threadId')})
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return messages, response.get('historyId', start_history_id)
+
+def full_scan(service, limit=LISTENER_FULL_SCAN_LIMIT, account=None):
+    """
+    Lists up to `limit` unread messages. Returns (messages, history_id to resume from).
+    """
+    # Take the history id first so nothing arriving during the scan is missed
+    history_id = call_with_limit("gmail", account, service.users().getProfile(userId='me').execute)['historyId']
+    messages = []
+    page_token = None
+    while len(messages) < limit:
+        results = call_with_limit("gmail", account, service.users().messages().list(
+            userId='me', q='is:unread', maxResults=min(500, limit - len(messages)), pageToken=page_token).execute)
+        messages.extend(results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+    return messages, history_id
+
+def batch_get_messages(service, message_ids, account=None, **get_kwargs):
+    """
+    Fetches messages through Gmail batch HTTP requests (GMAIL_BATCH_SIZE per round trip).
+    Sub-requests that fail are retried one by one; messages that still fail are left out.
+    Returns {message_id: message}; a message deleted since it was listed (404) maps to None.
+    """
+    results = {}
+    failed = []
+
+    def on_response(request_id, response, exception):
+        if exception is None:
+            results[request_id] = response
+        elif isinstance(exception, HttpError) and exception.resp.status == 404:
+            results[request_id] = None
+        else:
+            failed.append(request_id)
+
+    for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=on_response)
+        for message_id in message_ids[start:start + GMAIL_BATCH_SIZE]:
+            batch.add(service.users().messages().get(userId='me', id=message_id, **get_kwargs), request_id=message_id)
+        call_with_limit("gmail", account, batch.execute)
+
+    for message_id in failed:
+        try:
+            results[message_id] = call_with_limit("gmail", account, service.users().messages().get(
+                userId='me', id=message_id, **get_kwargs).execute)
+        except HttpError as e:
+            if e.resp.status == 404:
+                results[message_id] = None
+            else:
+                print(f"Could not fetch message {message_id}: {e}")
+    return results
+
+def fetch_attachment_data(service, message_id, attachment_id, account=None):
+    return call_with_limit("gmail", account, service.users().messages().attachments().get(
+        userId='me', messageId=message_id, id=attachment_id).execute).get('data', '')
+
+def mark_as_read(service, message_ids, account=None):
+    for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+        call_with_limit("gmail", account, service.users().messages().batchModify(
+            userId='me', body={'ids': message_ids[start:start + BATCH_MODIFY_LIMIT], 'removeLabelIds': ['UNREAD']}).execute)
+
+def lead_for_thread(conn, thread_id, account=None):
+    """
+    Lead that an outbound email in this thread went to (indexed lookup), or None.
+    Thread ids are per mailbox, so with an account only its sends (and sends
+    recorded before accounts existed) match.
+    """
+    if not thread_id:
+        return None
+    if account is None:
+        row = conn.execute("SELECT lead_id FROM sent_messages WHERE thread_id = ? LIMIT 1", (thread_id,)).fetchone()
+    else:
+        row = conn.execute("SELECT lead_id FROM sent_messages WHERE thread_id = ? AND (account = ? OR account IS NULL) LIMIT 1",
+                           (thread_id, account)).fetchone()
+    return row[0] if row else None
+
+def load_lead_email_index(conn):
+    """
+    Maps every normalized lead email to its lead id (first lead wins).
+    """
+    index = {}
+    for lead_id, email in conn.execute("SELECT id, email FROM leads WHERE email IS NOT NULL AND email != '' ORDER BY id"):
+        key = normalize_email(email)
+        if key and key not in index:
+            index[key] = lead_id
+    return index
 
 def process_replies():
-    service = get_gmail_service()
-    if not service:
-        return
+    """
+    Polls the inbox of every sending account in GMAIL_ACCOUNTS.
+    """
+    conn = get_db_connection()
+    lead_index = None
+    for account in account_names():
+        service = get_gmail_service(token_file(account))
+        if not service:
+            continue
+        if lead_index is None:
+            lead_index = {} if LISTENER_KNOWN_THREADS_ONLY else load_lead_email_index(conn)
+        print(f"Checking inbox of account '{account}'...")
+        try:
+            process_account_replies(conn, service, account, lead_index)
+        except Exception as e:
+            # One broken mailbox must not stop the others
+            print(f"Error checking account '{account}': {e}")
+    conn.close()
 
-    # List unread messages
-    results = service.users().messages().list(userId='me', q='is:unread').execute()
-    messages = results.get('messages', [])
+def process_account_replies(conn, service, account, lead_index):
+    cursor = conn.cursor()
+    history_key = f"{HISTORY_ID_KEY}:{account}"
+
+    # Incremental sync: only messages added since the last run
+    messages = None
+    history_id = get_state(conn, history_key)
+    if not history_id and account == account_names()[0]:
+        # Single-account installs stored the id without an account suffix
+        history_id = get_state(conn, HISTORY_ID_KEY)
+    if history_id:
+        messages, new_history_id = fetch_history(service, history_id, account)
+    if messages is None:
+        messages, new_history_id = full_scan(service, account=account)
 
     if not messages:
         print("No new messages.")
+        set_state(conn, history_key, new_history_id)
         return
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
+    # Phase 1a: replies in threads we started (covers aliases, assistants, forwards)
+    matched = {}
+    unmatched = []
     for message in messages:
-        msg = service.users().messages().get(userId='me', id=message['id']).execute()
-        
-        # Extract headers
-        headers = msg['payload']['headers']
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), None)
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), None)
-        
-        # Extract email address from sender "Name <email@example.com>"
-        email_address = sender.split('<')[-1].replace('>', '') if sender else None
-        
-        # Check if this email is in our leads db
-        cursor.execute("SELECT * FROM leads WHERE email = ?", (email_address,))
-        lead = cursor.fetchone()
-        
-        if lead:
+        lead_id = lead_for_thread(conn, message.get('threadId'), account)
+        if lead_id:
+            matched[message['id']] = lead_id
+        elif not LISTENER_KNOWN_THREADS_ONLY:
+            unmatched.append(message['id'])
+
+    # Phase 1b: headers only, matched against the in-memory lead index
+    metas = batch_get_messages(service, unmatched, account, format='metadata', metadataHeaders=['From'])
+    for message_id in unmatched:
+        meta = metas.get(message_id)
+        if not meta:
+            continue
+        headers = meta['payload'].get('headers', [])
+        sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
+        lead_id = lead_index.get(normalize_email(sender))
+        if lead_id:
+            matched[message_id] = lead_id
+
+    # Phase 2: full messages only for lead replies
+    full_messages = batch_get_messages(service, list(matched), account)
+    # A message that could not be fetched must come back in the next run's history
+    # (deleted messages count as fetched: they map to None)
+    fetch_failed = len(metas) < len(unmatched) or len(full_messages) < len(matched)
+    read_ids = []
+
+    for message_id, lead_id in matched.items():
+        msg = full_messages.get(message_id)
+        if msg:
+            sender = next((h['value'] for h in msg['payload'].get('headers', []) if h['name'].lower() == 'from'), None)
+            email_address = normalize_email(sender)
             print(f"Reply received from lead: {email_address}")
             
-            # Get body (simplified)
-            if 'parts' in msg['payload']:
-                parts = msg['payload']['parts']
-                data = parts[0]['body']['data']
-            else:
-                data = msg['payload']['body']['data']
-            
-            body = base64.urlsafe_b64decode(data).decode('utf-8')
+            # Best text part; quoted history, signature and attachments left out
+            body = extract_reply_text(msg['payload'], fetch_attachment=lambda attachment_id: fetch_attachment_data(
+                service, message_id, attachment_id, account))
             
             # Classify
-            category = classify_reply(body)
-            print(f"Classification: {category}")
+            category, source = classify_reply(conn, msg['payload'].get('headers', []), body)
+            print(f"Classification: {category} ({source})")
             
             # Update DB
             new_status = "Replied"
@@ -120,16 +275,23 @@ def process_replies():
             elif category == "LATER":
                 new_status = "Snoozed"
             
-            cursor.execute("UPDATE leads SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (new_status, lead['id']))
+            cursor.execute("UPDATE leads SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (new_status, lead_id))
             conn.commit()
             
-            # Stop Switch: If replied, we generally stop automated follow-ups (handled by status check in sender)
+            # Stop Switch: If replied, we generally stop automated follow-ups (the dispatcher cancels the lead's queued messages)
             print(f"Updated status for {email_address} to {new_status}")
             
-            # Mark as read
-            service.users().messages().modify(userId='me', id=message['id'], body={'removeLabelIds': ['UNREAD']}).execute()
+            read_ids.append(message_id)
 
-    conn.close()
+    # Mark as read in one call
+    if read_ids:
+        mark_as_read(service, read_ids, account)
+
+    # Saved last, so an interrupted run re-reads the same deltas
+    if fetch_failed:
+        print("Some messages could not be fetched; keeping the previous history id.")
+    else:
+        set_state(conn, history_key, new_history_id)
 
 if __name__ == "__main__":
     process_replies()
@@ -0,0 +1,219 @@
+from config import LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_SECONDS, OUTBOX_RETRY_MAX_SECONDS
+
+# Outbox states:
+#   pending -> sending -> sent
+#                      -> pending (retry after backoff) -> ... -> dead (attempts exhausted)
+#   LinkedIn: sending -> launched (PhantomBuster container running) -> sent / pending
+#   sending rows whose worker died are moved to dead: the send may have gone out.
+#   pending -> cancelled once the lead leaves SENDABLE_STATUSES (it replied, unsubscribed, ...)
+CHANNELS = ("email", "linkedin", "whatsapp")
+# Lead statuses that may still receive queued messages; each channel goes out at
+# its own slot, so a reply to the email must stop the lead's later channels
+SENDABLE_STATUSES = ("Approved", "Contacted")
+_SENDABLE_LEADS = f"SELECT id FROM leads WHERE status IN ({', '.join(repr(status) for status in SENDABLE_STATUSES)})"
+
+class PermanentFailure(Exception):
+    """
+    Raised by a send that must not be retried (e.g. it may already have gone out).
+    """
+
+# Which approved leads get a row on each channel
+CHANNEL_CONDITIONS = {
+    "email": "email IS NOT NULL AND email != '' AND draft_email_subject IS NOT NULL AND draft_email_body IS NOT NULL AND draft_email_body != ''",
+    "linkedin": "linkedin_url IS NOT NULL AND linkedin_url != '' AND draft_linkedin_note IS NOT NULL AND draft_linkedin_note != ''",
+    "whatsapp": "phone IS NOT NULL AND phone != '' AND draft_whatsapp_nudge IS NOT NULL AND draft_whatsapp_nudge != ''",
+}
+
+def enqueue_approved(conn, channels=CHANNELS):
+    """
+    Adds one outbox row per (approved lead, channel). The idempotency key is
+    '<lead_id>:<channel>', so re-running never queues a second send. Rows get
+    no next_attempt_at, so nothing can claim them before plan_sends gives them a slot.
+    Returns the number of new rows.
+    """
+    added = 0
+    with conn:
+        for channel in channels:
+            cursor = conn.execute(f"""
+                INSERT OR IGNORE INTO outbox (lead_id, channel, idempotency_key, next_attempt_at)
+                SELECT id, ?, id || ':' || ?, NULL FROM leads
+                WHERE status = 'Approved' AND {CHANNEL_CONDITIONS[channel]}
+            """, (channel, channel))
+            added += cursor.rowcount
+    return added
+
+def claim_jobs(conn, worker_id, channel, limit, account=None, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically moves up to `limit` due rows of a channel (and sending account, for
+    email) whose lead is still in SENDABLE_STATUSES to 'sending' and returns them
+    joined with their lead's contact details and drafts.
+    """
+    with conn:
+        ids = [row[0] for row in conn.execute(f"""
+            UPDATE outbox
+            SET state = 'sending', attempts = attempts + 1, claimed_by = ?,
+                lease_expires_at = datetime('now', ?), updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE channel = ? AND account IS ? AND state = 'pending' AND next_attempt_at <= datetime('now')
+                  AND lead_id IN ({_SENDABLE_LEADS})
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            )
+            RETURNING id
+        """, (worker_id, f"+{lease_seconds} seconds", channel, account, limit)).fetchall()]
+    if not ids:
+        return []
+    placeholders = ",".join("?" * len(ids))
+    return conn.execute(f"""
+        SELECT o.id AS job_id, o.channel, o.account, o.attempts, o.idempotency_key,
+               l.id, l.first_name, l.last_name, l.email, l.phone, l.linkedin_url,
+               l.draft_email_subject, l.draft_email_body, l.draft_linkedin_note,
+               l.draft_whatsapp_nudge, l.attachment_file
+        FROM outbox o JOIN leads l ON l.id = o.lead_id
+        WHERE o.id IN ({placeholders})
+        ORDER BY o.id
+    """, ids).fetchall()
+
+def cancel_stopped(conn):
+    """
+    Cancels the pending rows of leads that are no longer in SENDABLE_STATUSES
+    and frees their slots. Returns the number of rows cancelled.
+    """
+    with conn:
+        return conn.execute(f"""
+            UPDATE outbox
+            SET state = 'cancelled', last_error = 'Lead status changed before sending', scheduled_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE state = 'pending' AND lead_id NOT IN ({_SENDABLE_LEADS})
+        """).rowcount
+
+def renew_jobs(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    with conn:
+        conn.execute("UPDATE outbox SET lease_expires_at = datetime('now', ?) WHERE claimed_by = ? AND state = 'sending'",
+                     (f"+{lease_seconds} seconds", worker_id))
+
+def mark_sent(conn, job_id, external_id=None):
+    conn.execute("""
+        UPDATE outbox
+        SET state = 'sent', external_id = ?, last_error = NULL, claimed_by = NULL, lease_expires_at = NULL,
+            sent_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (external_id, job_id))
+
+def mark_launched(conn, job_id, container_id):
+    """
+    The launch was accepted; the row waits for its container to finish.
+    """
+    conn.execute("""
+        UPDATE outbox
+        SET state = 'launched', external_id = ?, last_error = NULL, claimed_by = NULL, lease_expires_at = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (container_id, job_id))
+
+def launched_containers(conn, limit):
+    """
+    Up to limit running containers, the longest-running first.
+    """
+    return [row[0] for row in conn.execute("""
+        SELECT external_id FROM outbox WHERE state = 'launched' AND external_id IS NOT NULL
+        GROUP BY external_id ORDER BY MIN(updated_at) LIMIT ?
+    """, (limit,))]
+
+def launch_in_progress(conn):
+    """
+    True while a LinkedIn row is being launched or its container is still running.
+    """
+    return conn.execute(
+        "SELECT 1 FROM outbox WHERE channel = 'linkedin' AND state IN ('sending', 'launched') LIMIT 1").fetchone() is not None
+
+def complete_launch(conn, container_id, ok, error=None):
+    """
+    Resolves every row launched in a container: sent (and the lead Contacted), or retried.
+    Returns the number of rows resolved.
+    """
+    rows = conn.execute("SELECT id, lead_id, attempts FROM outbox WHERE state = 'launched' AND external_id = ?",
+                        (container_id,)).fetchall()
+    for job_id, lead_id, attempts in rows:
+        if ok:
+            mark_sent(conn, job_id, container_id)
+            conn.execute("UPDATE leads SET status = 'Contacted', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'Approved'", (lead_id,))
+        else:
+            mark_failed(conn, job_id, attempts, error)
+    return len(rows)
+
+def mark_failed(conn, job_id, attempts, error, retry=True):
+    """
+    Schedules a retry with exponential backoff, or gives up after OUTBOX_MAX_ATTEMPTS
+    (at once with retry=False, for errors a retry cannot fix).
+    """
+    if not retry or attempts >= OUTBOX_MAX_ATTEMPTS:
+        conn.execute("""
+            UPDATE outbox SET state = 'dead', last_error = ?, claimed_by = NULL, lease_expires_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (error, job_id))
+        return
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    conn.execute("""
+        UPDATE outbox SET state = 'pending', last_error = ?, next_attempt_at = datetime('now', ?),
+            claimed_by = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (error, f"+{delay} seconds", job_id))
+
+def release_jobs(conn, job_ids):
+    """
+    Puts claimed rows that were never attempted back to 'pending', undoing the claim's attempt.
+    """
+    conn.executemany("""
+        UPDATE outbox SET state = 'pending', attempts = attempts - 1, claimed_by = NULL, lease_expires_at = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND state = 'sending'
+    """, [(job_id,) for job_id in job_ids])
+
+def recover_interrupted(conn):
+    """
+    'sending' rows with an expired lease belong to a worker that died mid-send.
+    They are not retried (the message may have gone out); they are marked dead for review.
+    """
+    with conn:
+        return conn.execute("""
+            UPDATE outbox
+            SET state = 'dead', last_error = 'Interrupted during send; not retried to avoid a double send',
+                claimed_by = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE state = 'sending' AND lease_expires_at < datetime('now')
+        """).rowcount
+
+def _lanes_condition(lanes):
+    # (channel, account) pairs -> SQL condition and parameters
+    condition = " OR ".join("(channel = ? AND account IS ?)" for _ in lanes) or "0"
+    return condition, tuple(value for lane in lanes for value in lane)
+
+def has_due_jobs(conn, lanes):
+    """
+    Whether any pending row on the given (channel, account) lanes is due.
+    """
+    condition, params = _lanes_condition(lanes)
+    return conn.execute(f"""
+        SELECT 1 FROM outbox
+        WHERE ({condition}) AND state = 'pending' AND next_attempt_at <= datetime('now')
+        LIMIT 1
+    """, params).fetchone() is not None
+
+def next_due_at(conn, lanes):
+    """
+    The earliest next_attempt_at (scheduled slot or retry) of a pending row on the lanes, or None.
+    """
+    condition, params = _lanes_condition(lanes)
+    return conn.execute(f"SELECT MIN(next_attempt_at) FROM outbox WHERE ({condition}) AND state = 'pending'",
+                        params).fetchone()[0]
+
+def outbox_stats(conn):
+    """
+    Returns {channel: {state: count}} for reporting.
+    """
+    stats = {channel: {} for channel in CHANNELS}
+    for channel, state, count in conn.execute("SELECT channel, state, COUNT(*) FROM outbox GROUP BY channel, state"):
+        stats.setdefault(channel, {})[state] = count
+    return stats
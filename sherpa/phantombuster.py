@@ -0,0 +1,134 @@
+import csv
+import json
+import time
+
+import requests
+
+from config import PHANTOMBUSTER_API_KEY, PHANTOMBUSTER_POLL_SECONDS, PHANTOMBUSTER_RUN_TIMEOUT_SECONDS
+from rate_limiter import limited_request
+
+API_URL = "https://api.phantombuster.com/api/v2"
+REQUEST_TIMEOUT_SECONDS = 30
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def _headers():
+    return {"X-Phantombuster-Key": PHANTOMBUSTER_API_KEY, "Content-Type": "application/json"}
+
+def _get(path, **params):
+    response = limited_request("phantombuster", "GET", f"{API_URL}/{path}", headers=_headers(),
+                               params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()
+
+def launch_agent(agent_id, argument):
+    """
+    Launches a phantom and returns its container id; errors are raised to the caller.
+    """
+    response = limited_request("phantombuster", "POST", f"{API_URL}/agents/launch", headers=_headers(),
+                               json={"id": agent_id, "argument": argument}, timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json().get("containerId")
+
+def fetch_container(container_id):
+    """
+    Returns the container resource ({'status': 'running'|'finished', 'exitCode', ...}).
+    """
+    return _get("containers/fetch", id=container_id)
+
+def wait_for_container(container_id, timeout=PHANTOMBUSTER_RUN_TIMEOUT_SECONDS):
+    """
+    Polls a container until it finishes, backing off from the first to the
+    second PHANTOMBUSTER_POLL_SECONDS value. Returns the finished container;
+    raises TimeoutError if it is still running after timeout seconds.
+    """
+    delay, max_delay = PHANTOMBUSTER_POLL_SECONDS
+    deadline = time.time() + timeout
+    while True:
+        container = fetch_container(container_id)
+        if container.get("status") == "finished":
+            return container
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError(f"PhantomBuster container {container_id} still {container.get('status')} after {timeout}s")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+def iter_json_values(chunks):
+    """
+    Yields the JSON values in a stream of text chunks as soon as each is
+    complete: JSON lines, a JSON array, or a mix. A value cut off by the end
+    of a chunk waits for the next one; a malformed line is skipped; a stream
+    that ends mid-value drops it.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        position = 0
+        while True:
+            # Separators between values: whitespace, the array brackets and commas
+            while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                # With a newline after the error the value cannot be completed
+                # (JSON strings hold no raw newlines): skip the malformed line.
+                # Otherwise it may just be cut off, so wait for more data.
+                line_end = buffer.find("\n", e.pos)
+                if line_end == -1:
+                    break
+                print(f"Skipping malformed result line: {buffer[position:line_end][:80]!r}")
+                position = line_end + 1
+                continue
+            if end == len(buffer) and not isinstance(value, (dict, list)):
+                break # A bare number or literal may continue in the next chunk
+            yield value
+            position = end
+        buffer = buffer[position:]
+
+def stream_file_rows(url):
+    """
+    Yields the rows of a result file (CSV, JSON array or JSON lines) while it downloads.
+    """
+    # Result files live on S3, outside the PhantomBuster API rate limit
+    response = requests.get(url, stream=True, timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    response.encoding = response.encoding or "utf-8"
+    try:
+        if url.split("?")[0].lower().endswith(".csv"):
+            yield from csv.DictReader(response.iter_lines(decode_unicode=True))
+        else:
+            yield from iter_json_values(response.iter_content(chunk_size=STREAM_CHUNK_BYTES, decode_unicode=True))
+    finally:
+        response.close()
+
+def stream_container_rows(container_id):
+    """
+    Yields the result rows of a finished container. Phantoms either put the rows
+    in their result object or point it at result files (jsonUrl / csvURL), which
+    are streamed; without a result object, JSON lines in the console output are used.
+    """
+    result = _get("containers/fetch-result-object", id=container_id).get("resultObject")
+    if isinstance(result, str):
+        result = json.loads(result) if result.strip() else None
+    if isinstance(result, list):
+        yield from result
+        return
+    if isinstance(result, dict):
+        url = result.get("jsonUrl") or result.get("csvURL") or result.get("csvUrl")
+        if url:
+            yield from stream_file_rows(url)
+        else:
+            yield result
+        return
+    output = _get("containers/fetch-output", id=container_id).get("output") or ""
+    for line in output.splitlines():
+        try:
+            value = json.loads(line)
+        except json.JSONDecodeError:
+            continue # Console log line
+        if isinstance(value, dict):
+            yield value
@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+import requests
+import time
+from email.utils import parsedate_to_datetime
+
+from config import DB_PATH, RATE_LIMITS, RATE_LIMIT_MAX_RETRIES
+
+# Backoff after a 429 without Retry-After: BASE * 2^penalty seconds
+BACKOFF_BASE_SECONDS = 2
+MAX_PENALTY = 6
+# A penalty level is forgiven after this long without another 429
+RECOVERY_SECONDS = 60
+
+_local = threading.local()
+
+def _get_connection():
+    # One connection per thread; transactions are managed explicitly
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        _local.conn = conn
+    return conn
+
+def _bucket_key(provider, model=None):
+    return f"{provider}:{model}" if model else provider
+
+def _limits_for(key, provider):
+    return RATE_LIMITS.get(key) or RATE_LIMITS.get(provider) or RATE_LIMITS["default"]
+
+def _load_bucket(conn, key, burst, now):
+    row = conn.execute("SELECT tokens, updated_at, blocked_until, penalty, last_limited_at FROM rate_limits WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO rate_limits (key, tokens, updated_at, blocked_until, penalty, last_limited_at) VALUES (?, ?, ?, 0, 0, 0)",
+                     (key, burst, now))
+        return burst, now, 0.0, 0, 0.0
+    return row
+
+def acquire(provider, model=None):
+    """
+    Blocks until a token is available for provider (and model, if it has its own limit).
+    The bucket lives in SQLite, so every process draws from the same budget.
+    """
+    key = _bucket_key(provider, model)
+    limits = _limits_for(key, provider)
+    conn = _get_connection()
+    while True:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated_at, blocked_until, penalty, last_limited_at = _load_bucket(conn, key, limits["burst"], now)
+            if penalty and now - last_limited_at > RECOVERY_SECONDS:
+                penalty -= 1
+                last_limited_at = now
+            rate = limits["rate"] / (2 ** penalty)
+            tokens = min(limits["burst"], tokens + (now - updated_at) * rate)
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute("UPDATE rate_limits SET tokens = ?, updated_at = ?, penalty = ?, last_limited_at = ? WHERE key = ?",
+                         (tokens, now, penalty, last_limited_at, key))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not wait:
+            return
+        time.sleep(wait)
+
+def report_rate_limited(provider, model=None, retry_after=None):
+    """
+    Records a 429: blocks the bucket for Retry-After (or an exponential backoff)
+    and halves its refill rate until it recovers.
+    """
+    key = _bucket_key(provider, model)
+    limits = _limits_for(key, provider)
+    conn = _get_connection()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _, _, blocked_until, penalty, _ = _load_bucket(conn, key, limits["burst"], now)
+        penalty = min(penalty + 1, MAX_PENALTY)
+        delay = retry_after if retry_after is not None else BACKOFF_BASE_SECONDS * (2 ** penalty)
+        conn.execute("UPDATE rate_limits SET tokens = 0, updated_at = ?, blocked_until = ?, penalty = ?, last_limited_at = ? WHERE key = ?",
+                     (now, max(blocked_until, now + delay), penalty, now, key))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"Rate limited by {key}: backing off {delay:.0f}s")
+
+def parse_retry_after(value):
+    """
+    Retry-After is either delta-seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit_info(exc):
+    """
+    Returns (is_rate_limited, retry_after) for errors raised by the Gemini,
+    Google API and requests clients.
+    """
+    # requests.HTTPError
+    response = getattr(exc, "response", None)
+    if response is not None and getattr(response, "status_code", None) == 429:
+        return True, parse_retry_after(response.headers.get("Retry-After"))
+    # googleapiclient HttpError
+    resp = getattr(exc, "resp", None)
+    if resp is not None and getattr(resp, "status", None) == 429:
+        return True, parse_retry_after(resp.get("retry-after"))
+    # Gmail reports per-user limits as 403 rateLimitExceeded / userRateLimitExceeded
+    if resp is not None and getattr(resp, "status", None) == 403 and b"ateLimitExceeded" in (getattr(exc, "content", None) or b""):
+        return True, parse_retry_after(resp.get("retry-after"))
+    # google.api_core ResourceExhausted / TooManyRequests (Gemini)
+    if getattr(exc, "code", None) == 429 or type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True, None
+    return False, None
+
+def call_with_limit(provider, model, fn, *args, **kwargs):
+    """
+    Calls fn under the provider/model rate limit, retrying 429s with backoff.
+    The last rate-limit error is re-raised once retries run out.
+    """
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        acquire(provider, model)
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            limited, retry_after = rate_limit_info(e)
+            if not limited or attempt == RATE_LIMIT_MAX_RETRIES:
+                raise
+            report_rate_limited(provider, model, retry_after)
+
+def limited_request(provider, method, url, session=None, **kwargs):
+    """
+    requests.request() under the provider rate limit. 429 responses are retried
+    (honoring Retry-After); the final response is returned as-is.
+    """
+    http = session or requests
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        acquire(provider)
+        response = http.request(method, url, **kwargs)
+        if response.status_code != 429 or attempt == RATE_LIMIT_MAX_RETRIES:
+            return response
+        report_rate_limited(provider, retry_after=parse_retry_after(response.headers.get("Retry-After")))
@@ -0,0 +1,138 @@
+import hashlib
+import re
+
+# Categories understood by the listener
+CATEGORIES = ("INTERESTED", "LATER", "STOP", "OTHER")
+
+# Header values that mark machine-generated mail (RFC 3834 and common vendor headers)
+AUTO_HEADERS = ("x-autoreply", "x-autorespond", "x-auto-response-suppress")
+BULK_PRECEDENCE = ("auto_reply", "bulk", "junk", "list")
+
+STOP_PATTERNS = re.compile(r"""
+    \bunsubscribe\b
+  | \bremove\s+me\b
+  | \btake\s+me\s+off\b
+  | \bopt[\s-]?out\b
+  | \bstop\s+(?:emailing|contacting|messaging|sending)\b
+  | \bdo\s+not\s+(?:contact|email|message)\s+me\b
+  | \bdon'?t\s+(?:contact|email|message)\s+me\b
+  | ^\s*(?:no\s+thanks?|not\s+interested)[\s.!]*$
+""", re.IGNORECASE | re.VERBOSE)
+
+# Words that can sit next to an opt-out without changing what the reply means
+OPT_OUT_FILLER = {"hi", "hello", "hey", "dear", "please", "thanks", "thank", "you", "ok", "okay",
+                  "sorry", "regards", "best", "cheers", "kind", "many"}
+# Other words an opt-out reply may contain (e.g. a name) before Gemini decides instead
+OPT_OUT_MAX_OTHER_WORDS = 2
+
+OTHER_PATTERNS = re.compile(r"""
+    \bout\s+of\s+(?:the\s+)?office\b
+  | \bautomatic\s+reply\b
+  | \bauto[\s-]?reply\b
+  | \baway\s+from\s+(?:the\s+)?office\b
+  | \bon\s+(?:annual|parental|maternity|paternity|sick)\s+leave\b
+  | \blimited\s+access\s+to\s+(?:my\s+)?e-?mail\b
+  | \bi(?:'m|\s+am)\s+no\s+longer\s+(?:with|at)\b
+  | \bdelivery\s+status\s+notification\b
+""", re.IGNORECASE | re.VERBOSE)
+
+# Where quoted history starts in a reply
+QUOTE_MARKERS = re.compile(r"""
+    ^\s*On\s.+wrote:\s*$
+  | ^\s*-{2,}\s*Original\s+Message\s*-{2,}
+  | ^\s*_{5,}\s*$
+  | ^\s*From:\s.+$
+  | ^\s*Sent\s+from\s+my\s
+""", re.IGNORECASE | re.VERBOSE | re.MULTILINE)
+
+def strip_quoted_history(body):
+    """
+    Drops quoted lines ('> ...') and everything from the first quote marker onward.
+    """
+    if not body:
+        return ""
+    match = QUOTE_MARKERS.search(body)
+    if match:
+        body = body[:match.start()]
+    lines = [line for line in body.splitlines() if not line.lstrip().startswith(">")]
+    return "\n".join(lines).strip()
+
+# Sign-offs and the RFC 3676 '-- ' delimiter; everything below is signature
+SIGNATURE_MARKERS = re.compile(r"""
+    ^--\s*$
+  | ^\s*(?:best|kind|warm|many\s+thanks)?\s*(?:regards|wishes|cheers|thanks|thank\s+you|best)[,!.]?\s*$
+""", re.IGNORECASE | re.VERBOSE | re.MULTILINE)
+# A sign-off only starts the signature when what follows looks like one:
+# at most this many lines, each no longer than a name, title or phone line
+SIGNATURE_MAX_LINES = 6
+SIGNATURE_MAX_LINE_CHARS = 60
+
+def _is_signature_block(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return len(lines) <= SIGNATURE_MAX_LINES and all(len(line) <= SIGNATURE_MAX_LINE_CHARS for line in lines)
+
+def strip_signature(body):
+    """
+    Cuts the body at the first signature delimiter, or the first sign-off
+    followed only by a short trailing block (name, title, contact lines),
+    after the opening line. A "Thanks!" in the middle of a reply is kept.
+    """
+    for match in SIGNATURE_MARKERS.finditer(body or ""):
+        if not body[:match.start()].strip():
+            continue
+        if match.group().strip().startswith("--") or _is_signature_block(body[match.end():]):
+            return body[:match.start()].rstrip()
+    return body or ""
+
+def normalize_body(body):
+    return re.sub(r"\s+", " ", strip_quoted_history(body)).strip().lower()
+
+def body_hash(body):
+    return hashlib.sha256(normalize_body(body).encode("utf-8")).hexdigest()
+
+def classify_by_headers(headers):
+    """
+    Returns 'OTHER' for autoresponders / bulk mail, else None.
+    headers is the Gmail payload list of {'name', 'value'}.
+    """
+    for header in headers or []:
+        name = header.get("name", "").lower()
+        value = (header.get("value") or "").strip().lower()
+        if name == "auto-submitted" and value and value != "no":
+            return "OTHER"
+        if name in AUTO_HEADERS:
+            return "OTHER"
+        if name == "precedence" and value in BULK_PRECEDENCE:
+            return "OTHER"
+    return None
+
+def is_opt_out(text):
+    """
+    Whether a reply is essentially just an opt-out: every sentence matches
+    STOP_PATTERNS except greetings, thanks and a name. An opt-out phrase next
+    to real content (e.g. a corporate footer under "I'm interested") is not.
+    """
+    matched = False
+    other_words = []
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", text):
+        if STOP_PATTERNS.search(sentence):
+            matched = True
+        else:
+            other_words += [word for word in re.findall(r"[a-z']+", sentence.lower()) if word not in OPT_OUT_FILLER]
+    return matched and len(other_words) <= OPT_OUT_MAX_OTHER_WORDS
+
+def pre_classify(headers, body):
+    """
+    Deterministic first pass. Returns a category, or None if Gemini should decide.
+    """
+    category = classify_by_headers(headers)
+    if category:
+        return category
+    text = strip_quoted_history(body)
+    if not text:
+        return "OTHER"
+    if is_opt_out(text):
+        return "STOP"
+    if OTHER_PATTERNS.search(text):
+        return "OTHER"
+    return None
@@ -0,0 +1,166 @@
+from datetime import datetime, time, timedelta, timezone
+
+from config import DAILY_LEAD_LIMIT, GMAIL_DAILY_SEND_CAP, SEND_WINDOW_HOURS
+from gmail_accounts import account_names, assign_accounts
+from outbox import next_due_at
+
+# Send slots are stored in outbox.scheduled_at (and next_attempt_at, which gates
+# claims) as UTC 'YYYY-MM-DD HH:MM:SS', the format of SQLite's datetime('now').
+# Quotas and the send window are per local calendar day and per lane: a channel,
+# or for email a (channel, sending account) pair, so each mailbox has its own cap.
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def to_db_time(dt):
+    return dt.astimezone(timezone.utc).strftime(TIME_FORMAT)
+
+def from_db_time(value):
+    return datetime.strptime(value, TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+def send_lanes(channels):
+    """
+    [(channel, account)] for the given channels; email has one lane per sending account.
+    """
+    lanes = []
+    for channel in channels:
+        if channel == "email":
+            lanes.extend((channel, account) for account in account_names())
+        else:
+            lanes.append((channel, None))
+    return lanes
+
+def lane_name(channel, account=None):
+    return f"{channel}:{account}" if account else channel
+
+def daily_limit(channel):
+    """
+    Messages per local day on a lane: DAILY_LEAD_LIMIT, and for each email
+    account never more than Gmail's per-account sending cap.
+    """
+    if channel == "email":
+        return min(DAILY_LEAD_LIMIT, GMAIL_DAILY_SEND_CAP)
+    return DAILY_LEAD_LIMIT
+
+def _local_bounds(day, start_hour, end_hour):
+    start = datetime.combine(day, time()) + timedelta(hours=start_hour)
+    end = datetime.combine(day, time()) + timedelta(hours=end_hour)
+    # Naive datetimes are local time
+    return start.astimezone(timezone.utc), end.astimezone(timezone.utc)
+
+def send_window(day):
+    return _local_bounds(day, *SEND_WINDOW_HOURS)
+
+def day_bounds(day):
+    return _local_bounds(day, 0, 24)
+
+def day_usage(conn, channel, day, account=None):
+    """
+    Returns (slots taken, latest slot) for a lane on a local day.
+    """
+    start, end = day_bounds(day)
+    count, last = conn.execute("""
+        SELECT COUNT(*), MAX(scheduled_at) FROM outbox
+        WHERE channel = ? AND account IS ? AND scheduled_at >= ? AND scheduled_at < ?
+    """, (channel, account, to_db_time(start), to_db_time(end))).fetchone()
+    return count, from_db_time(last) if last else None
+
+def assign_email_accounts(conn):
+    """
+    Copies each lead's sending account onto its pending email rows. A row whose
+    account changed loses its slot (and is not due until it gets a new one), since
+    that slot counted against the old mailbox.
+    """
+    assign_accounts(conn)
+    with conn:
+        conn.execute("""
+            UPDATE outbox
+            SET account = (SELECT sender_account FROM leads WHERE leads.id = outbox.lead_id),
+                scheduled_at = NULL, next_attempt_at = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE channel = 'email' AND state = 'pending'
+              AND account IS NOT (SELECT sender_account FROM leads WHERE leads.id = outbox.lead_id)
+        """)
+
+def validate_send_window():
+    start_hour, end_hour = SEND_WINDOW_HOURS
+    if not 0 <= start_hour < end_hour <= 24:
+        # No day would ever have room for a slot
+        raise ValueError(f"SEND_WINDOW_HOURS must be (start, end) with 0 <= start < end <= 24, got {SEND_WINDOW_HOURS}")
+
+def plan_sends(conn, channels, now=None):
+    """
+    Gives every unscheduled pending outbox row a send slot. Each lane's slots
+    are spread evenly over the local send window, at most daily_limit() per day;
+    whatever does not fit today rolls over to the next days.
+    Returns the number of rows scheduled.
+    """
+    validate_send_window()
+    now = now or utc_now()
+    if "email" in channels:
+        assign_email_accounts(conn)
+    planned = 0
+    with conn:
+        for channel, account in send_lanes(channels):
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM outbox WHERE channel = ? AND account IS ? AND state = 'pending' AND scheduled_at IS NULL ORDER BY id",
+                (channel, account))]
+            if ids:
+                planned += _plan_lane(conn, channel, account, ids, now)
+    return planned
+
+def _plan_lane(conn, channel, account, ids, now):
+    limit = daily_limit(channel)
+    if limit <= 0:
+        return 0
+    day = now.astimezone().date()
+    start, end = send_window(day)
+    interval = (end - start) / limit
+    i = 0
+    while i < len(ids):
+        start, end = send_window(day)
+        used, last = day_usage(conn, channel, day, account)
+        if used >= limit or now >= end:
+            day += timedelta(days=1)
+            continue
+        slot = max(start, now, last + interval if last else start)
+        if slot >= end:
+            day += timedelta(days=1)
+            continue
+        conn.execute("""
+            UPDATE outbox SET scheduled_at = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (to_db_time(slot), to_db_time(slot), ids[i]))
+        i += 1
+    return len(ids)
+
+def next_send_at(conn, lanes):
+    """
+    The earliest pending send (scheduled slot or retry) on the given lanes, or None.
+    """
+    value = next_due_at(conn, lanes)
+    return from_db_time(value) if value else None
+
+def quota_status(conn, channels, now=None):
+    """
+    Returns {lane name: {'limit', 'used', 'sent', 'remaining', 'next_send'}} for today.
+    'used' counts every slot scheduled today, sent or still waiting.
+    """
+    today = (now or utc_now()).astimezone().date()
+    start, end = day_bounds(today)
+    status = {}
+    for channel, account in send_lanes(channels):
+        used, _ = day_usage(conn, channel, today, account)
+        sent = conn.execute("""
+            SELECT COUNT(*) FROM outbox
+            WHERE channel = ? AND account IS ? AND state = 'sent' AND sent_at >= ? AND sent_at < ?
+        """, (channel, account, to_db_time(start), to_db_time(end))).fetchone()[0]
+        limit = daily_limit(channel)
+        status[lane_name(channel, account)] = {
+            "limit": limit,
+            "used": used,
+            "sent": sent,
+            "remaining": max(0, limit - used),
+            "next_send": next_send_at(conn, [(channel, account)]),
+        }
+    return status
@@ -1,187 +1,338 @@
-import os.path
 import base64
 import sqlite3
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.image import MIMEImage
-from email.mime.application import MIMEApplication
-from email import encoders
-import mimetypes
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
+import sys
 import time
-import requests
-from config import DB_PATH, PHANTOMBUSTER_API_KEY, LINKEDIN_CONNECTION_AGENT_ID
-from throttler import random_sleep, human_typing_delay
+import queue
+import threading
+from config import DB_PATH, LINKEDIN_CONNECTION_AGENT_ID, SENDER_CLAIM_BATCH, SEND_PACING_SECONDS, SENDER_PROGRESS_SECONDS
+from leases import make_worker_id
+from google_clients import get_gmail_service
+from rate_limiter import call_with_limit
+from phantombuster import launch_agent, fetch_container
+from dispatch import ChannelWorker
+from attachments import attachment_part, attachment_exists
+import whatsapp
+from scheduler import validate_send_window, plan_sends, next_send_at, quota_status, utc_now, send_lanes, lane_name
+from gmail_accounts import token_file, healthy_accounts, record_success, record_failure, is_account_error
+from outbox import PermanentFailure, CHANNELS, enqueue_approved, cancel_stopped, claim_jobs, renew_jobs, mark_sent, mark_failed, mark_launched, launched_containers, launch_in_progress, complete_launch, release_jobs, recover_interrupted, has_due_jobs, outbox_stats
 
-# If modifying these scopes, delete the file token.json.
-SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+MAX_IDLE_SECONDS = 60 # Longest wait of an idle dispatcher between outbox checks
+LINKEDIN_POLL_SECONDS = 60 # How often launched LinkedIn containers are checked
+LINKEDIN_POLL_MAX_CONTAINERS = 5 # Containers checked per poll; each fetch spends a PhantomBuster token
+LINKEDIN_POLL_LANE = "linkedin-poll"
+WORKER_STOP_SECONDS = 30 # How long shutdown waits for a send in progress
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
-def get_gmail_service():
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            if not os.path.exists('credentials.json'):
-                print("Error: credentials.json not found. Please download it from Google Cloud Console.")
-                return None
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    service = build('gmail', 'v1', credentials=creds)
-    return service
-
-def send_email(service, to_email, subject, body):
-    try:
+def deliver_email(service, to_email, subject, body, attachment_file=None, account=None):
+    """
+    Sends one email and returns the Gmail message resource ({'id', 'threadId', ...}).
+    attachment_file is a file name in assets/; account selects the per-mailbox
+    rate limit. Errors are raised to the caller.
+    """
+    if attachment_file:
+        message = MIMEMultipart()
+        message.attach(MIMEText(body))
+        message.attach(attachment_part(attachment_file))
+    else:
         message = MIMEText(body)
-        message['to'] = to_email
-        message['subject'] = subject
-        raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        message = {'raw': raw}
-        
-        sent_message = service.users().messages().send(userId="me", body=message).execute()
-        print(f"Email sent to {to_email}. Message Id: {sent_message['id']}")
-        return True
-    except Exception as e:
-        print(f"An error occurred sending email to {to_email}: {e}")
-        return False
-
-def send_whatsapp_nudge(driver, phone, message):
-    """
-    Sends a WhatsApp message using Selenium Web.
-    Requires the user to be logged in to WhatsApp Web.
+    message['to'] = to_email
+    message['subject'] = subject
+    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    message = {'raw': raw}
+    
+    sent_message = call_with_limit("gmail", account, service.users().messages().send(userId="me", body=message).execute)
+    print(f"Email sent to {to_email}. Message Id: {sent_message['id']}")
+    return sent_message
+
+def record_sent_message(conn, lead_id, to_email, sent_message, account=None):
     """
-    try:
-        # Format phone number (remove non-digits, ensure country code if needed)
-        # This is a simplified example.
-        
-        # Navigate to chat
-        url = f"https://web.whatsapp.com/send?phone={phone}&text={message}"
-        driver.get(url)
-        
-        # Wait for page load and send button
-        time.sleep(15) # Wait for page to load
-        
-        # Press Enter to send (or find the send button)
-        # This is fragile and depends on WhatsApp Web DOM
-        action = webdriver.ActionChains(driver)
-        action.send_keys(Keys.ENTER)
-        action.perform()
-        
-        time.sleep(5)
-        print(f"WhatsApp nudge sent to {phone}")
-        return True
-    except Exception as e:
-        print(f"Error sending WhatsApp to {phone}: {e}")
-        print(f"Error sending WhatsApp to {phone}: {e}")
-        return False
-
-def trigger_phantombuster_connection(linkedin_url, message):
-    """
-    Triggers the PhantomBuster LinkedIn Network Booster.
-    """
-    if LINKEDIN_CONNECTION_AGENT_ID == "YOUR_LINKEDIN_CONNECTION_AGENT_ID":
-        print("Skipping LinkedIn: Agent ID not configured.")
-        return
+    Stores the Gmail id and threadId so the listener can match replies by thread.
+    """
+    conn.execute("""
+        INSERT OR IGNORE INTO sent_messages (lead_id, gmail_message_id, thread_id, to_email, account)
+        VALUES (?, ?, ?, ?, ?)
+    """, (lead_id, sent_message['id'], sent_message.get('threadId'), to_email, account))
+
+def linkedin_configured():
+    return bool(LINKEDIN_CONNECTION_AGENT_ID) and LINKEDIN_CONNECTION_AGENT_ID != "YOUR_LINKEDIN_CONNECTION_AGENT_ID"
 
-    url = "https://api.phantombuster.com/api/v2/agents/launch"
-    headers = {
-        "X-Phantombuster-Key": PHANTOMBUSTER_API_KEY,
-        "Content-Type": "application/json"
+def launch_linkedin_connection(profile_url, note):
+    """
+    Launches the PhantomBuster LinkedIn Network Booster for one profile.
+    The agent takes a single message per launch and every note is personalized,
+    so profiles cannot share a launch. Returns the container id; errors are
+    raised to the caller.
+    """
+    argument = {
+        "profileUrls": [profile_url],
+        "message": note,
+        "numberOfAddsPerLaunch": 1
     }
-    payload = {
-        "id": LINKEDIN_CONNECTION_AGENT_ID,
-        "argument": {
-            "profileUrls": [linkedin_url],
-            "message": message,
-            "numberOfAddsPerLaunch": 1
-        }
+    container_id = launch_agent(LINKEDIN_CONNECTION_AGENT_ID, argument)
+    if not container_id:
+        # Without a container the launch can never be confirmed or retried
+        raise RuntimeError("PhantomBuster accepted the launch but returned no containerId")
+    print(f"LinkedIn connection queued for {profile_url} (container {container_id})")
+    return container_id
+
+def apply_container(conn, container_id, container):
+    """
+    A finished container marks its outbox row sent (exit code 0) or failed,
+    and its lead Contacted. Running containers are left for the next poll.
+    """
+    if container.get("status") != "finished":
+        return
+    ok = container.get("exitCode", 0) == 0
+    # A container polled twice is only resolved once
+    if complete_launch(conn, container_id, ok, None if ok else f"Container exited with code {container.get('exitCode')}"):
+        print(f"LinkedIn container {container_id} finished ({'ok' if ok else 'failed'}).")
+
+# --- Channel workers: each runs on its own thread with its own session ---
+# Jobs are outbox rows joined with their lead; results go back to run_dispatcher,
+# which is the only writer of outbox state.
+
+def email_session_opener(account):
+    return lambda: get_gmail_service(token_file(account))
+
+def send_email_job(service, job):
+    return deliver_email(service, job['email'], job['draft_email_subject'], job['draft_email_body'],
+                         job['attachment_file'], job['account'])
+
+def send_linkedin_job(session, job):
+    return launch_linkedin_connection(job['linkedin_url'], job['draft_linkedin_note'])
+
+def poll_container_job(session, container_id):
+    # Runs on its own worker so the dispatcher loop never waits on the PhantomBuster rate limit
+    return fetch_container(container_id)
+
+def open_whatsapp_session():
+    # The browser is shared across dispatcher runs and only starts on the first send
+    return whatsapp.shared_session()
+
+def send_whatsapp_job(session, job):
+    return session.send(job['phone'], job['draft_whatsapp_nudge'])
+
+def build_channel_workers(results, lanes):
+    """
+    One worker per lane: {lane name: (channel, account)}. Each Gmail account
+    sends from its own worker, with its own session and pacing.
+    """
+    senders = {
+        "email": send_email_job,
+        "linkedin": send_linkedin_job,
+        "whatsapp": send_whatsapp_job,
     }
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        print(f"LinkedIn connection queued for {linkedin_url}")
-    except Exception as e:
-        print(f"Error triggering LinkedIn Phantom: {e}")
+    workers = {}
+    for name, (channel, account) in lanes.items():
+        if channel == "email":
+            open_session = email_session_opener(account)
+        elif channel == "whatsapp":
+            open_session = open_whatsapp_session
+        else:
+            open_session = None
+        workers[name] = ChannelWorker(name, senders[channel], SEND_PACING_SECONDS.get(channel), open_session, results=results)
+    return workers
+
+def apply_results(conn, results):
+    """
+    Writes finished jobs back to the outbox. Returns how many were applied.
+    """
+    applied = 0
+    while True:
+        try:
+            lane, job, ok, value = results.get_nowait()
+        except queue.Empty:
+            return applied
+        applied += 1
+        channel = lane.partition(":")[0]
+        # A failure is an error string or the exception the send raised
+        error = None if ok else str(value)
+        retry = not isinstance(value, PermanentFailure)
+        with conn:
+            if lane == LINKEDIN_POLL_LANE:
+                # Jobs are container ids; a failed fetch is retried on the next poll
+                if ok:
+                    apply_container(conn, job, value)
+                else:
+                    print(f"Could not poll PhantomBuster container {job}: {error}")
+            elif channel == "linkedin" and ok:
+                mark_launched(conn, job['job_id'], value)
+            elif ok:
+                external_id = value.get('id') if isinstance(value, dict) else (value if isinstance(value, str) else None)
+                mark_sent(conn, job['job_id'], external_id)
+                if channel == "email":
+                    record_sent_message(conn, job['id'], job['email'], value, job['account'])
+                    record_success(conn, job['account'])
+                conn.execute("UPDATE leads SET status = 'Contacted', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'Approved'", (job['id'],))
+            else:
+                print(f"[{lane}] Attempt {job['attempts']} failed for {job['first_name']}: {error}")
+                mark_failed(conn, job['job_id'], job['attempts'], error, retry)
+                if channel == "email" and is_account_error(value):
+                    record_failure(conn, job['account'], error)
+
+def print_progress(workers):
+    print("Progress: " + " | ".join(worker.progress() for worker in workers.values()))
+
+def print_outbox_stats(conn):
+    for channel, states in outbox_stats(conn).items():
+        summary = ", ".join(f"{count} {state}" for state, count in sorted(states.items())) or "empty"
+        print(f"Outbox {channel}: {summary}")
+
+def print_schedule(conn, channels):
+    for channel, quota in quota_status(conn, channels).items():
+        next_send = quota['next_send'].astimezone().strftime("%Y-%m-%d %H:%M") if quota['next_send'] else "none"
+        print(f"Schedule {channel}: {quota['remaining']}/{quota['limit']} left today, next send {next_send}")
 
 def run_sender():
+    """
+    Queues approved leads and plans their send slots, then returns.
+    The messages are sent by run_dispatcher() as their slots come due.
+    """
+    # A bad window must fail before anything is queued
+    validate_send_window()
     conn = get_db_connection()
-    cursor = conn.cursor()
+    channels = active_channels()
     
-    # Get Approved leads
-    cursor.execute("SELECT * FROM leads WHERE status = 'Approved'")
-    leads = cursor.fetchall()
-    
-    if not leads:
+    # Queue approved leads (idempotent: one outbox row per lead and channel)
+    queued = enqueue_approved(conn, channels)
+    planned = plan_sends(conn, channels)
+    if queued or planned:
+        print(f"Queued {queued} new messages, scheduled {planned}.")
+    else:
         print("No approved leads to process.")
-        return
+    print_schedule(conn, channels)
+    conn.close()
 
-    # Initialize Gmail Service
-    gmail_service = get_gmail_service()
-    if not gmail_service:
-        return
+def active_channels():
+    return [channel for channel in CHANNELS if channel != "linkedin" or linkedin_configured()]
+
+def run_dispatcher(stop=None, once=False):
+    """
+    Sends outbox messages as their slots come due. Between slots it waits
+    (until the next slot, at most a minute) instead of sleeping per message.
+    With once=True it returns when nothing is due or in flight.
+    """
+    stop = stop or threading.Event()
+    conn = get_db_connection()
+    worker_id = make_worker_id("sender")
+    
+    interrupted = recover_interrupted(conn)
+    if interrupted:
+        print(f"{interrupted} sends were interrupted by a crash and need a manual check (outbox state 'dead').")
+    
+    results = queue.Queue()
+    lanes = {lane_name(channel, account): (channel, account) for channel, account in send_lanes(active_channels())}
+    workers = build_channel_workers(results, lanes)
+    poller = ChannelWorker(LINKEDIN_POLL_LANE, poll_container_job, results=results)
+    for worker in [*workers.values(), poller]:
+        worker.start()
 
-    # Initialize Selenium (only if there are leads)
-    options = webdriver.ChromeOptions()
-    options.add_argument("user-data-dir=selenium_data") # Keep session
+    in_flight = 0
+    last_report = time.time()
+    last_poll = 0
     try:
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-        print("Selenium driver initialized. Please scan QR code if needed.")
-        time.sleep(5) # Give time to load
-    except Exception as e:
-        print(f"Failed to initialize Selenium: {e}")
-        driver = None 
-
-    for lead in leads:
-        print(f"Processing outreach for {lead['email']}...")
-        
-        # 1. Send Email
-        if lead['email'] and lead['draft_email_subject'] and lead['draft_email_body']:
-            if send_email(gmail_service, lead['email'], lead['draft_email_subject'], lead['draft_email_body']):
-                # Update status
-                cursor.execute("UPDATE leads SET status = 'Contacted', updated_at = CURRENT_TIMESTAMP WHERE id = ?", (lead['id'],))
-                conn.commit()
-                
-                # Throttling
-                random_sleep(min_seconds=10, max_seconds=30) 
-        else:
-            print(f"Skipping Email for {lead['first_name']}: Missing email or draft.")
-        
-        # 2. LinkedIn
-        if lead['linkedin_url'] and lead['draft_linkedin_note']:
-            trigger_phantombuster_connection(lead['linkedin_url'], lead['draft_linkedin_note'])
-        
-        # 3. WhatsApp
-        if driver and lead['phone'] and lead['draft_whatsapp_nudge']:
-            send_whatsapp_nudge(driver, lead['phone'], lead['draft_whatsapp_nudge'])
-
-    if driver:
-        driver.quit()
-    conn.close()
+        while not stop.is_set():
+            if linkedin_configured() and time.time() - last_poll >= LINKEDIN_POLL_SECONDS and not poller.backlog():
+                last_poll = time.time()
+                for container_id in launched_containers(conn, LINKEDIN_POLL_MAX_CONTAINERS):
+                    poller.submit(container_id)
+                    in_flight += 1
+            
+            # Leads that replied or unsubscribed since their rows were queued get nothing more
+            cancelled = cancel_stopped(conn)
+            if cancelled:
+                print(f"Cancelled {cancelled} queued messages to leads that are no longer Approved/Contacted.")
+            
+            # Accounts cooling down after repeated failures are skipped until they recover
+            healthy = set(healthy_accounts(conn))
+            serving = [lanes[name] for name in workers if lanes[name][1] is None or lanes[name][1] in healthy]
+            
+            # Keep every lane fed from the outbox; claims are leased so parallel senders split the work
+            for channel, account in serving:
+                worker = workers[lane_name(channel, account)]
+                if channel == "linkedin":
+                    # The agent runs one container at a time: launch the next profile once the last one finished
+                    if not worker.backlog() and not launch_in_progress(conn):
+                        for job in claim_jobs(conn, worker_id, channel, 1):
+                            worker.submit(job)
+                            in_flight += 1
+                elif worker.backlog() < SENDER_CLAIM_BATCH:
+                    for job in claim_jobs(conn, worker_id, channel, SENDER_CLAIM_BATCH, account):
+                        if channel == "email" and job['attachment_file'] and not attachment_exists(job['attachment_file']):
+                            # Retrying cannot bring the file back, and it says nothing about the account
+                            print(f"[{lane_name(channel, account)}] Attachment {job['attachment_file']} for {job['first_name']} is missing from assets/.")
+                            with conn:
+                                mark_failed(conn, job['job_id'], job['attempts'], f"Attachment {job['attachment_file']} not found", retry=False)
+                            continue
+                        worker.submit(job)
+                        in_flight += 1
+            
+            in_flight -= apply_results(conn, results)
+            # LinkedIn rows behind a running container are not due until it finishes
+            ready = [lane for lane in serving if lane[0] != "linkedin" or not launch_in_progress(conn)]
+            due = has_due_jobs(conn, ready)
+            if once and not in_flight and not due:
+                break
+            
+            if in_flight:
+                renew_jobs(conn, worker_id)
+                if time.time() - last_report >= SENDER_PROGRESS_SECONDS:
+                    last_report = time.time()
+                    print_progress(workers)
+            
+            if in_flight or due:
+                wait = 1
+            else:
+                next_send = next_send_at(conn, ready)
+                wait = MAX_IDLE_SECONDS if next_send is None else (next_send - utc_now()).total_seconds()
+                wait = min(max(wait, 1), MAX_IDLE_SECONDS)
+            stop.wait(wait)
+    finally:
+        # Jobs that have not started go back to the outbox; only sends in progress are waited for
+        unstarted = []
+        for worker in workers.values():
+            unstarted.extend(worker.drain())
+            worker.close()
+        # Unstarted polls are simply dropped: their containers are polled again next run
+        poller.drain()
+        poller.close()
+        job_ids = [job['job_id'] for job in unstarted]
+        if job_ids:
+            with conn:
+                release_jobs(conn, job_ids)
+            print(f"Returned {len(job_ids)} unsent messages to the outbox.")
+        poller.join(WORKER_STOP_SECONDS)
+        for worker in workers.values():
+            worker.join(WORKER_STOP_SECONDS)
+            if worker.is_alive():
+                # Its claimed row stays 'sending' and is flagged by recover_interrupted once the lease expires
+                print(f"[{worker.channel}] Send still in progress after {WORKER_STOP_SECONDS}s; not waiting for it.")
+        apply_results(conn, results)
+        print("Dispatcher stopped.")
+        print_progress(workers)
+        print_outbox_stats(conn)
+        conn.close()
+
+_dispatcher = None
+
+def start_dispatcher():
+    """
+    Runs the dispatcher on a background thread (once per process), for the dashboard.
+    """
+    global _dispatcher
+    if _dispatcher is None or not _dispatcher.is_alive():
+        _dispatcher = threading.Thread(target=run_dispatcher, name="sender-dispatcher", daemon=True)
+        _dispatcher.start()
+    return _dispatcher
 
 if __name__ == "__main__":
+    # python sender.py: sends what is due now and exits (for cron / manual runs)
+    # python sender.py --daemon: keeps running and sends each message at its slot
     run_sender()
+    run_dispatcher(once="--daemon" not in sys.argv)
@@ -0,0 +1,13 @@
+def get_state(conn, key, default=None):
+    """
+    Reads a value from the sync_state key/value table.
+    """
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_state(conn, key, value):
+    with conn:
+        conn.execute("""
+            INSERT INTO sync_state (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+        """, (key, None if value is None else str(value)))
@@ -0,0 +1,144 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from webdriver_manager.chrome import ChromeDriverManager
+
+from config import DB_PATH, CHROMEDRIVER_PATH, WHATSAPP_LOAD_TIMEOUT, WHATSAPP_SENT_TIMEOUT
+from outbox import PermanentFailure
+from sync_state import get_state, set_state
+
+DRIVER_PATH_KEY = "chromedriver_path"
+
+# WhatsApp Web DOM hooks; these are fragile and change from time to time
+COMPOSE_BOX = "footer div[contenteditable='true']"
+POPUP = "div[data-animate-modal-popup='true']"
+OUTGOING_MESSAGE = "div.message-out"
+SENT_ICONS = "span[data-icon='msg-check'], span[data-icon='msg-dblcheck']"
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def chrome_driver_path(refresh=False):
+    """
+    Resolves the chromedriver binary once: CHROMEDRIVER_PATH if set, else the
+    path webdriver_manager installed, remembered in sync_state between runs.
+    """
+    global _driver_path
+    if CHROMEDRIVER_PATH:
+        return CHROMEDRIVER_PATH
+    with _driver_path_lock:
+        if _driver_path and not refresh:
+            return _driver_path
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        try:
+            path = None if refresh else get_state(conn, DRIVER_PATH_KEY)
+            if not path or not os.path.exists(path):
+                path = ChromeDriverManager().install()
+                set_state(conn, DRIVER_PATH_KEY, path)
+        finally:
+            conn.close()
+        _driver_path = path
+        return path
+
+def new_driver():
+    options = webdriver.ChromeOptions()
+    options.add_argument("user-data-dir=selenium_data") # Keep session
+    try:
+        return webdriver.Chrome(service=Service(chrome_driver_path()), options=options)
+    except Exception:
+        if CHROMEDRIVER_PATH:
+            raise
+        # The remembered driver may no longer match the installed Chrome
+        return webdriver.Chrome(service=Service(chrome_driver_path(refresh=True)), options=options)
+
+class InvalidNumber(PermanentFailure):
+    """
+    WhatsApp rejected the number; retrying cannot fix it.
+    """
+
+def _compose_box(driver):
+    # Wait condition: the compose box once the chat is open; raises if WhatsApp rejects the number
+    for popup in driver.find_elements(By.CSS_SELECTOR, POPUP):
+        if "invalid" in popup.text.lower():
+            raise InvalidNumber(popup.text.strip())
+    boxes = driver.find_elements(By.CSS_SELECTOR, COMPOSE_BOX)
+    return boxes[0] if boxes else False
+
+def _sent_tick(before):
+    # Wait condition: a new outgoing message that has left the clock state
+    def condition(driver):
+        messages = driver.find_elements(By.CSS_SELECTOR, OUTGOING_MESSAGE)
+        return len(messages) > before and bool(messages[-1].find_elements(By.CSS_SELECTOR, SENT_ICONS))
+    return condition
+
+def send_message(driver, phone, message):
+    """
+    Opens the chat with the message pre-filled, sends it and waits for the sent tick.
+    Returns the seconds it took. Errors before Enter is pressed are raised to the
+    caller; once it is pressed the message may be out, so a missing tick only
+    logs "unconfirmed" and any other error is raised as a PermanentFailure.
+    """
+    started = time.time()
+    digits = "".join(ch for ch in str(phone) if ch.isdigit())
+    driver.get(f"https://web.whatsapp.com/send?phone={digits}&text={quote(message)}")
+    box = WebDriverWait(driver, WHATSAPP_LOAD_TIMEOUT).until(_compose_box)
+    before = len(driver.find_elements(By.CSS_SELECTOR, OUTGOING_MESSAGE))
+    try:
+        box.send_keys(Keys.ENTER)
+        WebDriverWait(driver, WHATSAPP_SENT_TIMEOUT).until(_sent_tick(before))
+    except TimeoutException:
+        print(f"WhatsApp message to {phone} sent (unconfirmed): no sent tick after {WHATSAPP_SENT_TIMEOUT}s")
+    except Exception as e:
+        raise PermanentFailure(f"WhatsApp send to {phone} failed after Enter; not retried to avoid a double send: {e}") from e
+    return time.time() - started
+
+class WhatsAppSession:
+    """
+    One logged-in Chrome window shared by every WhatsApp send in the process.
+    The browser starts on the first send and is restarted if it has gone away.
+    """
+    def __init__(self):
+        self.driver = None
+        self.lock = threading.Lock()
+
+    def _ensure_driver(self):
+        if self.driver is not None:
+            try:
+                self.driver.current_url # Raises once the browser is gone
+                return self.driver
+            except Exception:
+                self.driver = None
+        self.driver = new_driver()
+        print("Selenium driver initialized. Please scan QR code if needed.")
+        return self.driver
+
+    def send(self, phone, message):
+        with self.lock:
+            seconds = send_message(self._ensure_driver(), phone, message)
+        print(f"WhatsApp nudge sent to {phone} in {seconds:.1f}s")
+        return True
+
+    def quit(self):
+        with self.lock:
+            if self.driver is not None:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+                self.driver = None
+
+_session = WhatsAppSession()
+atexit.register(_session.quit)
+
+def shared_session():
+    return _session
@@ -1,15 +1,11 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 import time
+from whatsapp import new_driver
 
 def login_whatsapp():
     print("Initializing Selenium for WhatsApp Login...")
-    options = webdriver.ChromeOptions()
-    options.add_argument("user-data-dir=selenium_data") # Keep session
     
     try:
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        driver = new_driver()
         driver.get("https://web.whatsapp.com")
         print("WhatsApp Web opened.")
         print("Please scan the QR code if you are not logged in.")